@@ -7,35 +7,875 @@ Requires gnuplot and liberation fonts installed.
 # SPDX-License-Identifier: BSD-2-Clause
 from __future__ import print_function, division
 
+import array
+import bisect
 import calendar
 import glob
 import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import multiprocessing
+import multiprocessing.pool
 import os
+import random
+import re
 import socket
 import sys
 import time
+import warnings
+
+
+try:
+    intern
+except NameError:
+    # Python 3
+    from sys import intern
+
+if str is bytes:
+    # Python 2, where intern() takes only native, byte, strings
+    def polystr(data):
+        "Return bytes read from a file as a native string."
+        return data
+
+    def polybytes(text):
+        "Return a native string as bytes to write to a file."
+        return text
+else:
+    def polystr(data):
+        "Return bytes read from a file as a native string."
+        return data.decode('utf-8', 'replace')
+
+    def polybytes(text):
+        "Return a native string as bytes to write to a file."
+        return text.encode('utf-8')
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    # Python 2, or built without liblzma
+    lzma = None
+
+try:
+    import sqlite3
+except ImportError:
+    # Python built without SQLite, no Warehouse
+    sqlite3 = None
+
+try:
+    import numpy
+    # Before 1.23 numpy.loadtxt() was a Python loop, no faster than ours
+    vectorize = (1, 23) <= tuple([int(x) for x in
+                                  numpy.__version__.split('.')[:2]])
+except ImportError:
+    numpy = None
+    vectorize = False
+
+
+class StatTable:
+    "Columnar store of the rows of one statistics stem."
+    # Field numbers are the same as in a split log line with the
+    # timestamp replaced: fields 0 and 1 are the time, the log data
+    # starts at field 2.  Numbers live in array('d') columns, short
+    # strings are interned so each peer or device name is stored once.
+
+    def __init__(self, kinds):
+        # kinds has one letter per field from field 2 on:
+        # 'd' number, 's' short string, 't' text to the end of the line
+        self.kinds = kinds
+        self.times = array.array('d')   # Unix time, in seconds
+        self.columns = [None, None]
+        for kind in kinds:
+            if 'd' == kind:
+                self.columns.append(array.array('d'))
+            else:
+                self.columns.append([])
+        self.numbers = [fld for fld in range(2, len(self.columns))
+                        if 'd' == kinds[fld - 2]]
+        self.strings = [fld for fld in range(2, len(self.columns))
+                        if 's' == kinds[fld - 2]]
+        if 't' in kinds:
+            self.text = kinds.index('t') + 2
+        else:
+            self.text = None
+        # Row numbers of each source, the string in field 2, kept up
+        # while rows are appended.  None when not known, sources()
+        # then makes it anew.
+        if 's' == kinds[:1]:
+            self.index = {}
+        else:
+            self.index = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        "Return row i as a list, for the odd caller that wants rows."
+        t = self.times[i]
+        row = [int(t * 1000), repr(t)]
+        for column in self.columns[2:]:
+            row.append(column[i])
+        return row
+
+    def column(self, fld):
+        "Return the column holding field fld."
+        return self.columns[fld]
+
+    def maxsplit(self, first):
+        "Return the split() limit that keeps a trailing text field whole."
+        if self.text is None:
+            return -1
+        return first + self.text - 2
+
+    def append(self, t, split, first):
+        "Append a row, split is a log line split, field 2 at split[first]."
+        # HOT LOOP!  Do not change w/o profiling before and after
+        offset = first - 2
+        try:
+            numbers = [float(split[fld + offset]) for fld in self.numbers]
+            strings = [intern(split[fld + offset]) for fld in self.strings]
+        except (IndexError, ValueError):
+            # unparseable, skip this line
+            return
+        if self.index is not None:
+            rows = self.index.get(strings[0])
+            if rows is None:
+                rows = self.index[strings[0]] = array.array('L')
+            rows.append(len(self.times))
+        self.times.append(t)
+        columns = self.columns
+        for (fld, value) in zip(self.numbers, numbers):
+            columns[fld].append(value)
+        for (fld, value) in zip(self.strings, strings):
+            columns[fld].append(value)
+        if self.text is not None:
+            if len(split) > self.text + offset:
+                columns[self.text].append(split[self.text + offset].strip())
+            else:
+                columns[self.text].append('')
+
+    def appendrow(self, t, values):
+        "Append a row of values ready for the columns, field 2 first."
+        if self.index is not None:
+            rows = self.index.get(values[0])
+            if rows is None:
+                rows = self.index[values[0]] = array.array('L')
+            rows.append(len(self.times))
+        self.times.append(t)
+        for (fld, value) in enumerate(values):
+            self.columns[fld + 2].append(value)
+
+    def nbytes(self):
+        "Return about how many bytes the rows take."
+        # the strings of 's' columns are shared, only the pointers count
+        size = 8 * len(self.times)
+        for fld in range(2, len(self.columns)):
+            size += 8 * len(self.times)
+            if fld == self.text:
+                size += sum([sys.getsizeof(x) for x in self.columns[fld]])
+        if self.index is not None:
+            size += 8 * len(self.times)
+        return size
+
+    def take(self, indices):
+        "Return a new table of the rows at indices, in that order."
+        table = StatTable(self.kinds)
+        table.index = None
+        table.times = array.array('d', [self.times[i] for i in indices])
+        for fld in range(2, len(self.columns)):
+            column = self.columns[fld]
+            values = [column[i] for i in indices]
+            if 'd' == self.kinds[fld - 2]:
+                values = array.array('d', values)
+            table.columns[fld] = values
+        return table
+
+    def extend(self, other):
+        "Append the rows of other, a table with the same kinds."
+        if self.index is not None and other.index is not None:
+            start = len(self.times)
+            for (key, rows) in other.index.items():
+                rows = array.array('L', [i + start for i in rows])
+                if key in self.index:
+                    self.index[key].extend(rows)
+                else:
+                    self.index[key] = rows
+        else:
+            self.index = None
+        self.times.extend(other.times)
+        for fld in range(2, len(self.columns)):
+            self.columns[fld].extend(other.columns[fld])
+
+    def window(self, starttime, endtime):
+        "Return the rows of a sorted table from starttime to endtime."
+        lo = bisect.bisect_left(self.times, starttime)
+        hi = bisect.bisect_right(self.times, endtime)
+        if 0 == lo and len(self.times) == hi:
+            return self
+        table = self.take(range(lo, hi))
+        if self.index is not None:
+            # the rows of each source in the window, renumbered
+            table.index = {}
+            for (key, rows) in self.index.items():
+                first = bisect.bisect_left(rows, lo)
+                last = bisect.bisect_left(rows, hi)
+                if first < last:
+                    table.index[key] = array.array(
+                        'L', [i - lo for i in rows[first:last]])
+        return table
+
+    def dump(self, fp):
+        "Write the table to the binary file fp, see load()."
+        strings = []
+        for fld in range(2, len(self.columns)):
+            if 'd' != self.kinds[fld - 2]:
+                strings.append(polybytes('\n'.join(self.columns[fld])))
+        header = "%s %s %d %s\n" % (self.kinds, sys.byteorder, len(self),
+                                    ",".join([str(len(x)) for x in strings]))
+        fp.write(header.encode('ascii'))
+        self.times.tofile(fp)
+        for fld in self.numbers:
+            self.columns[fld].tofile(fp)
+        for data in strings:
+            fp.write(data)
+
+    @staticmethod
+    def load(fp):
+        "Read a table written by dump() from the binary file fp."
+        header = fp.readline().decode('ascii').rstrip('\n').split(' ')
+        (kinds, byteorder, rows, lengths) = header
+        if byteorder != sys.byteorder:
+            raise ValueError("cache written on a different byte order")
+        rows = int(rows)
+        table = StatTable(kinds)
+        table.index = None
+        table.times.fromfile(fp, rows)
+        for fld in table.numbers:
+            table.columns[fld].fromfile(fp, rows)
+        if lengths:
+            lengths = [int(x) for x in lengths.split(',')]
+        else:
+            lengths = []
+        if len(lengths) != len(kinds) - len(table.numbers):
+            raise ValueError("bad cache header")
+        names = {}
+        for fld in range(2, len(table.columns)):
+            if 'd' == kinds[fld - 2]:
+                continue
+            data = polystr(fp.read(lengths.pop(0)))
+            if rows:
+                # share equal strings, as intern() does on ingest
+                table.columns[fld] = [names.setdefault(x, x)
+                                      for x in data.split('\n')]
+            if len(table.columns[fld]) != rows:
+                raise ValueError("truncated cache")
+        return table
+
+    def sort(self):
+        "Sort the rows by time, rows with equal times keep their order."
+        times = self.times
+        for i in range(1, len(times)):
+            if times[i - 1] > times[i]:
+                break
+        else:
+            # already in order, the usual case
+            return self
+        order = sorted(range(len(times)), key=times.__getitem__)
+        return self.take(order)
+
+    @staticmethod
+    def merge(tables, kinds):
+        "Return the rows of tables, each sorted by time, in one sorted table."
+        tables = [table for table in tables if len(table)]
+        # Log parts mostly follow each other, then putting them in order
+        # is all it takes.  Otherwise merge them, which is linear, where
+        # sorting all the rows again is not.
+        if 1 == len(tables):
+            return tables[0]
+        tables.sort(key=lambda table: table.times[0])
+        merged = StatTable(kinds)
+        runs = []
+        overlap = False
+        for table in tables:
+            if len(merged) and merged.times[-1] > table.times[0]:
+                overlap = True
+            runs.append((len(merged), len(merged) + len(table)))
+            merged.extend(table)
+        if not overlap:
+            return merged
+
+        times = merged.times
+
+        def run(start, end):
+            for i in range(start, end):
+                yield (times[i], i)
+
+        order = [i for (_, i) in heapq.merge(
+            *[run(start, end) for (start, end) in runs])]
+        return merged.take(order)
+
+    def sources(self):
+        "Return a dictionary mapping each field 2 string to its row numbers."
+        if self.index is None:
+            self.index = {}
+            for (i, key) in enumerate(self.columns[2]):
+                if key not in self.index:
+                    self.index[key] = array.array('L')
+                self.index[key].append(i)
+        return self.index
+
+    def split(self, fld):
+        "Return a dictionary mapping the values of fld to row subsets."
+        if 2 == fld and 's' == self.kinds[0]:
+            # known from ingest, most of the time
+            indices = self.sources()
+        else:
+            indices = {}
+            for (i, key) in enumerate(self.columns[fld]):
+                if key not in indices:
+                    indices[key] = []
+                indices[key].append(i)
+        subsets = {}
+        for (key, rows) in indices.items():
+            subsets[key] = self.take(rows)
+        return subsets
+
+
+class QuantileSketch:
+    "Mergeable quantile sketch of a stream of numbers, in bounded memory."
+    # A KLL sketch: level h holds samples that stand for 2**h values
+    # each.  A full level is sorted and every other sample moves up a
+    # level, so the rank error stays near 1/k of the count while the
+    # sketch holds a few times k samples whatever the count.  Whether
+    # the odd or the even samples move up is a coin toss, from a
+    # generator seeded by seed, so a report comes out the same each
+    # run; sketches to be merged should have different seeds, or their
+    # errors add up.  Min, max, mean and standard deviation are kept
+    # exactly.
+
+    def __init__(self, values=(), k=200, seed=0):
+        self.k = k
+        self.levels = [[]]
+        self.coin = random.Random(seed)
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mu = 0.0           # running mean
+        self.m2 = 0.0           # sum of squared deviations from mu
+        self.extend(values)
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self, level):
+        "Return the number of samples level may hold before compacting."
+        depth = len(self.levels) - 1 - level
+        return int(self.k * (2.0 / 3.0) ** depth) + 2
+
+    def moments(self, count, mu, m2):
+        "Fold the count, mean and squared deviations of more values in."
+        # pairwise update, Chan et al.
+        total = self.count + count
+        delta = mu - self.mu
+        self.mu += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def extend(self, values):
+        "Add values, any iterable of numbers."
+        values = iter(values)
+        while True:
+            block = list(itertools.islice(values, self.k))
+            if not block:
+                break
+            mu = sum(block) / len(block)
+            self.moments(len(block), mu, sum([(x - mu) ** 2 for x in block]))
+            low = min(block)
+            high = max(block)
+            if self.min is None or low < self.min:
+                self.min = low
+            if self.max is None or high > self.max:
+                self.max = high
+            self.levels[0].extend(block)
+            self.compact()
+
+    def merge(self, other):
+        "Add the values summarized by other, another sketch, to this one."
+        if not other.count:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for (level, samples) in enumerate(other.levels):
+            self.levels[level].extend(samples)
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.moments(other.count, other.mu, other.m2)
+        self.compact()
+        return self
+
+    def compact(self):
+        "Move half of an overfull level up a level, until all fit."
+        # lazy, as in KLL: only compact when the sketch as a whole is
+        # full, lower levels then hold more than their share for longer
+        while True:
+            size = sum([len(samples) for samples in self.levels])
+            limit = sum([self.capacity(level)
+                         for level in range(len(self.levels))])
+            if size < limit:
+                return
+            for (level, samples) in enumerate(self.levels):
+                if len(samples) >= self.capacity(level):
+                    break
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            samples.sort()
+            # an odd one out stays behind
+            keep = samples[len(samples) - len(samples) % 2:]
+            half = samples[self.coin.getrandbits(1):
+                           len(samples) - len(keep):2]
+            self.levels[level + 1].extend(half)
+            self.levels[level] = keep
+
+    def quantile(self, q):
+        "Return the value below which fraction q of the values lie."
+        if not self.count:
+            return 0
+        if 0 >= q:
+            return self.min
+        if 1 <= q:
+            return self.max
+        weighted = []
+        for (level, samples) in enumerate(self.levels):
+            weighted.extend([(x, 1 << level) for x in samples])
+        weighted.sort()
+        # the rank a sorted list of all values would be indexed at
+        rank = int(q * sum([w for (_, w) in weighted]))
+        seen = 0
+        for (x, weight) in weighted:
+            seen += weight
+            if seen > rank:
+                return x
+        return self.max
+
+    def mean(self):
+        "Return the mean of the values."
+        return self.mu
+
+    def pstdev(self):
+        "Return the population standard deviation of the values."
+        if 2 > self.count:
+            return 0
+        return (self.m2 / self.count) ** 0.5
+
+
+class Rollup:
+    "Hourly or daily aggregates of the numeric fields of a stem."
+    # One row of buckets per time bucket and source: the source, then
+    # the count, then min, max, mean and squared deviations of each
+    # numeric field.  Daily rollups also keep a small QuantileSketch
+    # of each field, as rows of sketches: source, field, level, sample.
+    # Buckets starting before done are complete.
+
+    SketchSize = 64     # k of the daily sketches
+
+    def __init__(self, stem, resolution):
+        self.stem = stem
+        self.resolution = resolution
+        kinds = NTPStats.fieldkinds[stem]
+        self.fields = [fld for fld in range(2, len(kinds) + 2)
+                       if 'd' == kinds[fld - 2]]
+        self.keyed = 's' == kinds[0]
+        self.buckets = StatTable('s' + 'd' * (1 + 4 * len(self.fields)))
+        self.sketches = StatTable('sddd')
+        self.done = 0
+
+    def add(self, table, done):
+        "Aggregate the rows of table, sorted and from done on, up to done."
+        times = table.times
+        lo = 0
+        while lo < len(times):
+            start = times[lo] - times[lo] % self.resolution
+            hi = bisect.bisect_left(times, start + self.resolution, lo)
+            if self.keyed:
+                groups = {}
+                sources = table.column(2)
+                for i in range(lo, hi):
+                    if sources[i] not in groups:
+                        groups[sources[i]] = []
+                    groups[sources[i]].append(i)
+            else:
+                groups = {'': range(lo, hi)}
+            for source in sorted(groups):
+                rows = groups[source]
+                row = [source, float(len(rows))]
+                for fld in self.fields:
+                    column = table.column(fld)
+                    values = [column[i] for i in rows]
+                    mu = sum(values) / len(values)
+                    row.extend([min(values), max(values), mu,
+                                sum([(x - mu) ** 2 for x in values])])
+                    if NTPStats.SecondsInDay <= self.resolution:
+                        sketch = QuantileSketch(values, k=self.SketchSize,
+                                                seed=int(start) + fld)
+                        for (level, samples) in enumerate(sketch.levels):
+                            for x in samples:
+                                self.sketches.appendrow(
+                                    start, [source, float(fld),
+                                            float(level), x])
+                self.buckets.appendrow(start, row)
+            lo = hi
+        self.done = done
+
+    def view(self, starttime, endtime):
+        "Return the buckets in the window as rows of the stem, of means."
+        # each bucket becomes one row at its middle, the strings other
+        # than the source are left empty
+        kinds = NTPStats.fieldkinds[self.stem]
+        table = StatTable(kinds)
+        buckets = self.buckets
+        lo = bisect.bisect_left(buckets.times,
+                                starttime - self.resolution / 2)
+        hi = bisect.bisect_right(buckets.times,
+                                 endtime - self.resolution / 2)
+        for i in range(lo, hi):
+            row = []
+            for fld in range(2, len(kinds) + 2):
+                if fld in self.fields:
+                    row.append(buckets.column(
+                        6 + 4 * self.fields.index(fld))[i])
+                elif 2 == fld:
+                    row.append(buckets.column(2)[i])
+                else:
+                    row.append('')
+            table.appendrow(buckets.times[i] + self.resolution / 2, row)
+        return table
+
+    def sketch(self, fld, source, starttime, endtime):
+        "Return a QuantileSketch of a field of the days in the window."
+        merged = QuantileSketch()
+        if source is None:
+            source = ''
+        buckets = self.buckets
+        sketches = self.sketches
+        lo = bisect.bisect_right(buckets.times, starttime - self.resolution)
+        hi = bisect.bisect_right(buckets.times, endtime)
+        first = 3 + 4 * self.fields.index(fld)
+        for i in range(lo, hi):
+            if buckets.column(2)[i] != source:
+                continue
+            # the exact moments of the day, the samples come next
+            day = QuantileSketch(k=self.SketchSize)
+            day.count = int(buckets.column(3)[i])
+            day.min = buckets.column(first + 1)[i]
+            day.max = buckets.column(first + 2)[i]
+            day.mu = buckets.column(first + 3)[i]
+            day.m2 = buckets.column(first + 4)[i]
+            start = buckets.times[i]
+            for j in range(bisect.bisect_left(sketches.times, start),
+                           bisect.bisect_right(sketches.times, start)):
+                if (source != sketches.column(2)[j] or
+                        fld != sketches.column(3)[j]):
+                    continue
+                level = int(sketches.column(4)[j])
+                while len(day.levels) <= level:
+                    day.levels.append([])
+                day.levels[level].append(sketches.column(5)[j])
+            merged.merge(day)
+        return merged
+
+    def dump(self, fp):
+        "Write the rollup to the binary file fp, see load()."
+        fp.write(("ntpstats-rollup 1 %s %d %r\n" % (
+            self.stem, self.resolution, self.done)).encode('ascii'))
+        self.buckets.dump(fp)
+        self.sketches.dump(fp)
+
+    @staticmethod
+    def load(fp):
+        "Read a rollup written by dump() from the binary file fp."
+        header = fp.readline().decode('ascii').split()
+        if 5 != len(header) or header[:2] != ["ntpstats-rollup", "1"]:
+            raise ValueError("not a rollup file")
+        rollup = Rollup(header[2], int(header[3]))
+        rollup.done = float(header[4])
+        rollup.buckets = StatTable.load(fp)
+        rollup.sketches = StatTable.load(fp)
+        return rollup
+
+
+class Resolver:
+    "DNS lookups, made many at once, remembered for a while."
+    # A lookup is a (kind, key) query: 'name' is the primary hostname
+    # of an address, 'addr' the IPv4 address of a name or address,
+    # 'fqdn' what socket.getfqdn() makes of it.  Answers, None for a
+    # failed lookup, are kept with their expiry time, in cachefile
+    # between runs if one is given.  A query still unanswered after
+    # Timeout keeps its stale answer, if any, and is not asked again
+    # for FailTTL, so a slow DNS server stalls a run once, not every
+    # batch.
+
+    TTL = 86400         # seconds an answer is good for
+    FailTTL = 3600      # seconds a failed lookup is good for
+    Timeout = 5         # seconds to wait for a batch of lookups
+    Workers = 16        # most lookups at once
+
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        self.answers = {}       # (kind, key): (answer, expires)
+        self.late = {}          # query that timed out: when to ask again
+        if cachefile is not None:
+            try:
+                self.load()
+            except (IOError, OSError, ValueError):
+                # no cache yet, or a bad one
+                self.answers = {}
+
+    @staticmethod
+    def lookup(query):
+        "Return the answer to one query, None if the lookup fails."
+        (kind, key) = query
+        try:
+            if 'name' == kind:
+                return socket.gethostbyaddr(key)[0]
+            if 'addr' == kind:
+                return socket.gethostbyname(key)
+            return socket.getfqdn(key)
+        except (socket.error, UnicodeError):
+            # herror and gaierror are socket.errors
+            return None
+
+    def resolve(self, queries):
+        "Answer the queries not known yet, or expired, all at once."
+        now = time.time()
+        todo = sorted(set([query for query in queries
+                           if self.answers.get(query, (None, 0))[1] <= now
+                           and self.late.get(query, 0) <= now]))
+        if not todo:
+            return
+        # Threads, as the lookups mostly wait on the network.  The
+        # pool is never joined, a lookup past the deadline is left to
+        # finish on its own.
+        pool = multiprocessing.pool.ThreadPool(min(self.Workers, len(todo)))
+        results = [pool.apply_async(Resolver.lookup, (query,))
+                   for query in todo]
+        pool.close()
+        deadline = now + self.Timeout
+        for (query, result) in zip(todo, results):
+            try:
+                answer = result.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                self.late[query] = now + self.FailTTL
+                continue
+            self.late.pop(query, None)
+            if answer is None:
+                self.answers[query] = (None, now + self.FailTTL)
+            else:
+                self.answers[query] = (answer, now + self.TTL)
+        if self.cachefile is not None:
+            self.save()
+
+    def answer(self, kind, key):
+        "Return the answer to a query, None if there is none."
+        query = (kind, key)
+        if query not in self.answers:
+            self.resolve([query])
+        return self.answers.get(query, (None, 0))[0]
+
+    def load(self):
+        "Read the answers saved by save()."
+        with open(self.cachefile) as fp:
+            if fp.readline().split() != ["ntpstats-dns", "1"]:
+                raise ValueError("not a DNS cache file")
+            for line in fp:
+                (expires, kind, key, answer) = line.split()
+                if '-' == answer:
+                    answer = None
+                self.answers[(kind, key)] = (answer, float(expires))
+
+    def save(self):
+        "Write the answers to cachefile, less those long expired."
+        # an expired answer is still good when a lookup times out
+        stale = time.time() - self.TTL
+        try:
+            with open(self.cachefile + ".tmp", 'w') as fp:
+                fp.write("ntpstats-dns 1\n")
+                for ((kind, key), (answer, expires)) in sorted(
+                        self.answers.items()):
+                    if expires < stale:
+                        continue
+                    fp.write("%r %s %s %s\n"
+                             % (expires, kind, key, answer or '-'))
+            os.rename(self.cachefile + ".tmp", self.cachefile)
+        except (IOError, OSError):
+            sys.stderr.write("ntpviz: WARNING: could not write %s\n"
+                             % self.cachefile)
+
+
+class Warehouse:
+    "The rows of the statistics of many statsdirs, in an SQLite database."
+    # One table per stem: the statsdir, the time, then a column per
+    # field, f2, f3, ..., indexed by time and by source.  Log parts
+    # are imported incrementally.  A log part is known by its first
+    # log line, which survives rotation and compression, with how many
+    # uncompressed bytes of it were imported.  A log file whose size
+    # and mtime did not change since the last import is not opened.
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS parts (dir INTEGER, stem TEXT, first TEXT,
+                                  done INTEGER,
+                                  PRIMARY KEY (dir, stem, first));
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER,
+                                  mtime REAL);
+""")
+        for (stem, kinds) in NTPStats.fieldkinds.items():
+            columns = ["f%d %s" % (fld + 2, 'REAL' if 'd' == kind else 'TEXT')
+                       for (fld, kind) in enumerate(kinds)]
+            self.db.execute("CREATE TABLE IF NOT EXISTS %s "
+                            "(dir INTEGER, time REAL, %s)"
+                            % (stem, ", ".join(columns)))
+            self.db.execute("CREATE INDEX IF NOT EXISTS %s_time "
+                            "ON %s (dir, time)" % (stem, stem))
+            if 's' == kinds[0]:
+                self.db.execute("CREATE INDEX IF NOT EXISTS %s_source "
+                                "ON %s (dir, f2, time)" % (stem, stem))
+        self.db.commit()
+
+    def dirid(self, statsdir):
+        "Return the number of a statsdir in the database, added if new."
+        statsdir = os.path.abspath(statsdir)
+        row = self.db.execute("SELECT id FROM dirs WHERE path = ?",
+                              (statsdir,)).fetchone()
+        if row is not None:
+            return row[0]
+        with self.db:
+            return self.db.execute("INSERT INTO dirs (path) VALUES (?)",
+                                   (statsdir,)).lastrowid
+
+    def update(self, statsdir, stem, logparts):
+        "Import the rows of the log parts of a stem added since last time."
+        dirid = self.dirid(statsdir)
+        kinds = NTPStats.fieldkinds[stem]
+        insert = "INSERT INTO %s VALUES (?, ?, %s)" % (
+            stem, ", ".join("?" * len(kinds)))
+        for logpart in sorted(logparts):
+            path = os.path.abspath(logpart)
+            try:
+                st = os.stat(logpart)
+                row = self.db.execute("SELECT size, mtime FROM files "
+                                      "WHERE path = ?", (path,)).fetchone()
+                if row is not None and tuple(row) == (st.st_size,
+                                                      st.st_mtime):
+                    continue
+                first = NTPStats.firstline(logpart, stem)
+                if first is None:
+                    continue
+                row = self.db.execute("SELECT done FROM parts WHERE dir = ? "
+                                      "AND stem = ? AND first = ?",
+                                      (dirid, stem, first)).fetchone()
+                (table, done) = NTPStats.readtail(
+                    logpart, stem, 0 if row is None else row[0],
+                    float('-inf'), float('inf'))
+            except (IOError, OSError, EOFError):
+                sys.stderr.write("ntpviz: WARNING: could not read %s\n"
+                                 % logpart)
+                continue
+            columns = [itertools.repeat(dirid), table.times]
+            with self.db:
+                self.db.executemany(insert,
+                                    zip(*(columns + table.columns[2:])))
+                self.db.execute("INSERT OR REPLACE INTO parts "
+                                "VALUES (?, ?, ?, ?)",
+                                (dirid, stem, first, done))
+                self.db.execute("INSERT OR REPLACE INTO files "
+                                "VALUES (?, ?, ?)",
+                                (path, st.st_size, st.st_mtime))
+
+    def read(self, statsdir, stem, starttime, endtime, source=None):
+        "Return the rows of a stem from starttime to endtime, sorted by time."
+        "Only those of source, the string in field 2, if given."
+        kinds = NTPStats.fieldkinds[stem]
+        table = StatTable(kinds)
+        sql = "SELECT time, %s FROM %s WHERE dir = ? AND time BETWEEN ? AND ?"
+        sql %= (", ".join(["f%d" % (fld + 2) for fld in range(len(kinds))]),
+                stem)
+        params = [self.dirid(statsdir), starttime, endtime]
+        if source is not None:
+            sql += " AND f2 = ?"
+            params.append(source)
+        # rows of one time in the order they were logged
+        sql += " ORDER BY time, rowid"
+        strings = [fld for (fld, kind) in enumerate(kinds) if 's' == kind]
+        names = {}
+        for row in self.db.execute(sql, params):
+            values = list(row[1:])
+            for fld in strings:
+                # share equal strings, as intern() does on ingest
+                values[fld] = names.setdefault(values[fld], values[fld])
+            table.appendrow(row[0], values)
+        return table
 
 
 class NTPStats:
     "Gather statistics for a specified NTP site"
     SecondsInDay = 24*60*60
     DefaultPeriod = 7*24*60*60  # default 7 days, 604800 secs
-    peermap = {}    # cached result of peersplit()
     period = None
+    statsdir = None
+    cachedir = None     # directory for parsed log parts, None: no cache
+    workers = 1         # processes reading log parts
+    follow = False      # remember read offsets for refresh()
+    rollupdir = None    # directory of hourly and daily aggregates
+    resolution = 0      # seconds per row of stems read from rollups
+    Resolutions = (86400, 3600)     # of rollups, coarsest first
+    rollupstems = ("gpsd", "loopstats", "peerstats", "temps")
     starttime = None
     endtime = None
     sitename = ''
 
+    vectorize = vectorize   # parse with NumPy, see readvector()
+    ChunkSize = 1 << 20     # bytes read from a compressed log part at once
+    # Readers of compressed log parts, found by their first bytes: the
+    # magic, the suffix a rotation gives them, and a function opening
+    # one to read bytes.  Anything else is read as it is.
+    readers = [(b'\x1f\x8b', ".gz", gzip.open)]
+    if bz2 is not None:
+        readers.append((b'BZh', ".bz2", bz2.BZ2File))
+    if lzma is not None:
+        readers.append((b'\xfd7zXZ\x00', ".xz", lzma.open))
+    stems = ("clockstats", "peerstats", "loopstats", "rawstats",
+             "temps", "gpsd")
+
+    # Layout of the fields after the timestamp, see StatTable
+    fieldkinds = {
+        "clockstats": "st",     # clock, timecode
+        "gpsd": "sdd",          # device, TDOP, nSat
+        "loopstats": "ddddd",   # offset, freq, jitter, wander, time constant
+        "peerstats": "ssdddd",  # peer, status, offset, delay, disp, jitter
+        "rawstats": "ssddddt",  # src, dst, org, rec, xmt, dst, the rest
+        "temps": "sd",          # source, temperature
+    }
+
     @staticmethod
-    def unixize(lines, starttime, endtime):
+    def unixize(lines, starttime, endtime, table):
         "Extract first two fields, MJD and seconds past midnight."
         "convert timestamp (MJD & seconds past midnight) to Unix time"
-        "Replace MJD+second with Unix time."
+        "Append the rows in the time window to table, as Unix time."
         # HOT LOOP!  Do not change w/o profiling before and after
-        lines1 = []
+        maxsplit = table.maxsplit(2)
         for line in lines:
             try:
-                split = line.split()
+                split = line.split(None, maxsplit)
                 mjd = int(split[0])
                 second = float(split[1])
             except:
@@ -45,21 +885,666 @@ class NTPStats:
             # warning: 32 bit overflows
             time = NTPStats.SecondsInDay * mjd + second - 3506716800
             if starttime <= time <= endtime:
-                # time as integer number milli seconds
-                split[0] = int(time * 1000)
-                # time as string
-                split[1] = str(time)
-                lines1.append(split)
-        return lines1
+                table.append(time, split, 2)
+        return table
+
+    @staticmethod
+    def unixtimes(lines, starttime, endtime, table):
+        "Append the rows in the time window, already in Unix time, to table."
+        maxsplit = table.maxsplit(1)
+        for line in lines:
+            split = line.split(None, maxsplit)
+            if 3 > len(split):
+                # skip short lines
+                continue
+
+            try:
+                t = float(split[0])
+            except:
+                # ignore comment lines, lines with no time
+                continue
+
+            if starttime <= t <= endtime:
+                table.append(t, split, 1)
+        return table
+
+    @staticmethod
+    def reader(logpart):
+        "Return the entry of readers for a log part, None if plain."
+        with open(logpart, 'rb') as fp:
+            magic = fp.read(8)
+        for reader in NTPStats.readers:
+            if magic.startswith(reader[0]):
+                return reader
+        return None
+
+    @staticmethod
+    def openpart(logpart):
+        "Open a log part to read bytes, decompressed if it is compressed."
+        reader = NTPStats.reader(logpart)
+        if reader is None:
+            return open(logpart, 'rb')
+        return reader[2](logpart, 'rb')
+
+    @staticmethod
+    def chunkrange(chunk, stem):
+        "Return the times of the first and last lines of a chunk of lines."
+        # None for a line without a time, a comment say
+        end = chunk.find(b'\n')
+        first = NTPStats.linetime(chunk[:end].decode('utf-8', 'replace'),
+                                  stem)
+        start = chunk.rfind(b'\n', 0, len(chunk) - 1) + 1
+        last = NTPStats.linetime(chunk[start:].decode('utf-8', 'replace'),
+                                 stem)
+        return (first, last)
+
+    @staticmethod
+    def readlines(logpart, stem=None, starttime=None, endtime=None):
+        "Generate the lines of a log part, one by one."
+        # Never read a whole log part into memory, the caller only keeps
+        # the lines it wants.  A plain one is read as text, line by line
+        # in C.  A compressed one is read in big chunks, split here,
+        # faster than a text layer over the decompressor.
+        #
+        # Given the stem and a window, chunks of a compressed log part
+        # that end before starttime are decompressed but not split, and
+        # reading stops at the first chunk after endtime.  Deflate
+        # streams cannot be entered in the middle from Python, zlib
+        # has no inflatePrime(), so this is as close to random access
+        # as it gets.  Log lines are in time order, give or take a
+        # clock step, so a chunk is only skipped when its first and
+        # last lines are both outside the window.
+        reader = NTPStats.reader(logpart)
+        if reader is None:
+            if str is bytes:
+                # native strings on Python 2 too
+                logfile = open(logpart, 'r')
+            else:
+                logfile = io.open(logpart, 'r', encoding='utf-8',
+                                  errors='replace')
+            try:
+                for line in logfile:
+                    yield line
+            finally:
+                logfile.close()
+            return
+
+        logfile = reader[2](logpart, 'rb')
+        try:
+            rest = b''
+            while True:
+                chunk = logfile.read(NTPStats.ChunkSize)
+                if not chunk:
+                    break
+                chunk = rest + chunk
+                cut = chunk.rfind(b'\n') + 1
+                rest = chunk[cut:]
+                if stem is not None and cut:
+                    (first, last) = NTPStats.chunkrange(chunk[:cut], stem)
+                    if first is not None and last is not None:
+                        if last < starttime and first < starttime:
+                            continue
+                        if first > endtime and last > endtime:
+                            rest = b''
+                            break
+                for line in polystr(chunk[:cut]).splitlines(True):
+                    yield line
+            if rest:
+                yield polystr(rest)
+        finally:
+            logfile.close()
+
+    @staticmethod
+    def linetime(line, stem):
+        "Return the Unix time of a log line, None if it has none."
+        split = line.split(None, 2)
+        try:
+            if stem == "temps" or stem == "gpsd":
+                return float(split[0])
+            return (NTPStats.SecondsInDay * int(split[0]) + float(split[1])
+                    - 3506716800)
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def partrange(logpart, stem, starttime, endtime):
+        "Return the earliest and latest times possible in a log part."
+        # Look no further than needed to decide whether the log part
+        # overlaps starttime to endtime.  The mtime is when the last
+        # line was written.
+        first = float('-inf')
+        last = os.path.getmtime(logpart)
+        if starttime > last:
+            return (first, last)
+
+        # filegen day, month and year names tell the times they hold,
+        # when the mtime agrees: a filegen pid name, like .1012 or
+        # .201612, only looks like one
+        suffix = os.path.basename(logpart)[len(stem):]
+        match = re.match(r"\.(\d{4})(\d{2})?(\d{2})?(\.|$)", suffix)
+        if match:
+            (year, month, day) = match.group(1, 2, 3)
+            year = int(year)
+            if month is None:
+                begin = (year, 1, 1)
+                end = (year + 1, 1, 1)
+            elif day is None:
+                month = int(month)
+                begin = (year, month, 1)
+                end = (year + month // 12, month % 12 + 1, 1)
+            else:
+                begin = end = (year, int(month), int(day))
+            if 1 <= begin[1] <= 12 and 1 <= begin[2] <= 31:
+                first = calendar.timegm(begin + (0, 0, 0))
+                if day is None:
+                    end = calendar.timegm(end + (0, 0, 0))
+                else:
+                    end = first + NTPStats.SecondsInDay
+                # a part may be compressed a while after it is done
+                if first <= last <= end + NTPStats.SecondsInDay:
+                    # the seconds in log lines have three decimals
+                    return (first, min(last, end - 0.001))
+                first = float('-inf')
+
+        # Otherwise look at the first line, and the last line of an
+        # uncompressed log part.  Both are only a seek away.
+        try:
+            t = None
+            lines = NTPStats.readlines(logpart)
+            for (i, line) in enumerate(lines):
+                t = NTPStats.linetime(line, stem)
+                if t is not None or 100 < i:
+                    break
+            lines.close()
+            if t is not None:
+                first = t
+            if endtime < first or NTPStats.reader(logpart) is not None:
+                return (first, last)
+            with open(logpart, 'rb') as fp:
+                fp.seek(0, os.SEEK_END)
+                size = fp.tell()
+                fp.seek(max(0, size - 4096))
+                tail = fp.read().decode('ascii', 'replace').splitlines()
+            if 4096 < size:
+                # the first line read is likely cut
+                tail = tail[1:]
+            for line in reversed(tail):
+                t = NTPStats.linetime(line, stem)
+                if t is not None:
+                    return (first, min(last, t))
+        except (IOError, OSError, EOFError):
+            # let readstem() complain about it
+            pass
+        return (first, last)
+
+    @staticmethod
+    def readvector(logpart, stem, starttime, endtime):
+        "Return the rows of a log part from starttime to endtime, by NumPy."
+        # Parse big blocks of lines at once into typed arrays, then
+        # compute the times and the window in one go.  Raises ValueError
+        # on any line out of the usual layout, the caller then falls
+        # back to unixize(), which skips such lines.
+        kinds = NTPStats.fieldkinds[stem]
+        if stem == "temps" or stem == "gpsd":
+            dtype = [('time', 'f8')]
+        else:
+            dtype = [('mjd', 'f8'), ('second', 'f8')]
+        for (i, kind) in enumerate(kinds):
+            if 'd' == kind:
+                dtype.append(('f%d' % (i + 2), 'f8'))
+            else:
+                dtype.append(('f%d' % (i + 2), 'U64'))
+        usecols = range(len(dtype))
+
+        table = StatTable(kinds)
+        table.index = None      # made by sources() when needed
+        lines = NTPStats.readlines(logpart, stem, starttime, endtime)
+        try:
+            while True:
+                block = list(itertools.islice(lines, 1 << 18))
+                if not block:
+                    break
+                with warnings.catch_warnings():
+                    # a block of only comments is no news
+                    warnings.simplefilter("ignore")
+                    rows = numpy.loadtxt(block, dtype=dtype,
+                                         usecols=usecols, ndmin=1)
+                if stem == "temps" or stem == "gpsd":
+                    times = rows['time']
+                else:
+                    times = (NTPStats.SecondsInDay * rows['mjd']
+                             + rows['second'] - 3506716800)
+                keep = (starttime <= times) & (times <= endtime)
+                table.times.frombytes(times[keep].tobytes())
+                for fld in table.numbers:
+                    values = rows['f%d' % fld][keep]
+                    table.columns[fld].frombytes(values.tobytes())
+                for fld in table.strings:
+                    values = rows['f%d' % fld][keep].tolist()
+                    table.columns[fld].extend([intern(x) for x in values])
+        finally:
+            lines.close()
+        return table.sort()
+
+    @staticmethod
+    def readpart(logpart, stem, starttime, endtime):
+        "Return the rows of a log part from starttime to endtime."
+        if NTPStats.vectorize and 't' not in NTPStats.fieldkinds[stem]:
+            try:
+                return NTPStats.readvector(logpart, stem, starttime, endtime)
+            except ValueError:
+                # an odd line, take the slow road
+                pass
+        table = StatTable(NTPStats.fieldkinds[stem])
+        # stream the lines, only the rows in the window are kept
+        lines = NTPStats.readlines(logpart, stem, starttime, endtime)
+        if stem == "temps" or stem == "gpsd":
+            # temps and gpsd are already in UNIX time
+            NTPStats.unixtimes(lines, starttime, endtime, table)
+        else:
+            # Morph first fields into Unix time with fractional seconds
+            NTPStats.unixize(lines, starttime, endtime, table)
+        return table.sort()
+
+    @staticmethod
+    def cachepath(logpart, cachedir):
+        "Return the name of the cache file of a log part."
+        logpart = os.path.abspath(logpart)
+        digest = hashlib.sha1(logpart.encode('utf-8')).hexdigest()
+        return os.path.join(cachedir, "%s.%s" % (
+            os.path.basename(logpart), digest[:12]))
+
+    @staticmethod
+    def readcached(logpart, stem, cachedir):
+        "Return all the rows of a log part, from the cache when current."
+        # Rotated log parts never change, so the parsed rows are kept in
+        # a binary file of the cache directory, valid while the log part
+        # keeps its size and mtime.
+        st = os.stat(logpart)
+        key = ("ntpstats-cache 1 %s %d %r\n" % (NTPStats.fieldkinds[stem],
+               st.st_size, st.st_mtime)).encode('ascii')
+        cachefile = NTPStats.cachepath(logpart, cachedir)
+        try:
+            with open(cachefile, 'rb') as fp:
+                if key == fp.readline():
+                    return StatTable.load(fp)
+        except (IOError, OSError, EOFError, ValueError):
+            # missing or bad cache file, parse the log part
+            pass
+
+        table = NTPStats.readpart(logpart, stem, 0, float('inf'))
+        try:
+            with open(cachefile + ".tmp", 'wb') as fp:
+                fp.write(key)
+                table.dump(fp)
+            os.rename(cachefile + ".tmp", cachefile)
+        except (IOError, OSError):
+            sys.stderr.write("ntpviz: WARNING: could not write %s\n"
+                             % cachefile)
+        return table
+
+    @staticmethod
+    def readtail(logpart, stem, offset, starttime, endtime):
+        "Return the rows after byte offset of a log part, and the new offset."
+        # Only complete lines are read from a growing log part, the
+        # offset returned is just past the last of them.  Offsets in
+        # compressed log parts count uncompressed bytes.
+        table = StatTable(NTPStats.fieldkinds[stem])
+        # compressed ones are never written to
+        complete = NTPStats.reader(logpart) is not None
+        logfile = NTPStats.openpart(logpart)
+        try:
+            logfile.seek(offset)
+            rest = b''
+            while True:
+                chunk = logfile.read(1 << 20)
+                if not chunk:
+                    break
+                chunk = rest + chunk
+                cut = chunk.rfind(b'\n') + 1
+                rest = chunk[cut:]
+                offset += cut
+                lines = polystr(chunk[:cut]).splitlines()
+                if stem == "temps" or stem == "gpsd":
+                    NTPStats.unixtimes(lines, starttime, endtime, table)
+                else:
+                    NTPStats.unixize(lines, starttime, endtime, table)
+            if complete and rest:
+                offset += len(rest)
+                lines = [polystr(rest)]
+                if stem == "temps" or stem == "gpsd":
+                    NTPStats.unixtimes(lines, starttime, endtime, table)
+                else:
+                    NTPStats.unixize(lines, starttime, endtime, table)
+        finally:
+            logfile.close()
+        return (table.sort(), offset)
+
+    @staticmethod
+    def firstline(logpart, stem):
+        "Return the first line of a log part with a time, None if none yet."
+        # It tells a log part from the others, whatever its name and
+        # inode after rotation and compression.  Comments may be alike.
+        first = ""
+        lines = NTPStats.readlines(logpart)
+        try:
+            for (i, line) in enumerate(lines):
+                if NTPStats.linetime(line, stem) is not None or 100 < i:
+                    first = line
+                    break
+        finally:
+            lines.close()
+        if not first.endswith("\n"):
+            # empty, or the first line is being written
+            return None
+        return first
+
+    @staticmethod
+    def uncompressed(logpart):
+        "Return the name of a log part before compression, or None."
+        for (_, suffix, _) in NTPStats.readers:
+            if logpart.endswith(suffix):
+                return logpart[:-len(suffix)]
+        return None
+
+    def logparts(self, stem):
+        "Return the names of the log parts of a stem."
+        pattern = os.path.join(self.statsdir, stem)
+        if stem != "temps" and stem != "gpsd":
+            pattern += "."
+        return glob.glob(pattern + "*")
+
+    def readnew(self, stem):
+        "Return the rows of a stem logged since the last read, in follow mode."
+        # For each log part remember its identity, size and mtime, how
+        # far it was read, and its first line.  Log parts may be
+        # renamed, and a rotated one compressed, between two reads: a
+        # renamed one keeps its inode, a compressed one its first line.
+        # The inode of a removed one may be reused by a new one.
+        known = self.tails.get(stem, {})
+        seen = {}
+        firsts = {}
+        for (ident, stamp, offset, first) in known.values():
+            seen[ident] = (stamp, offset, first)
+            if first is not None:
+                firsts[first] = offset
+        tails = {}
+        parts = []
+        for logpart in self.logparts(stem):
+            try:
+                st = os.stat(logpart)
+                ident = (st.st_dev, st.st_ino)
+                stamp = (st.st_size, st.st_mtime)
+                if ident in seen:
+                    (was, offset, first) = seen[ident]
+                    if was == stamp:
+                        # nothing new
+                        tails[logpart] = (ident, stamp, offset, first)
+                        continue
+                    if first is not None and \
+                       first != NTPStats.firstline(logpart, stem):
+                        # another log part on a reused inode
+                        ident = None
+                    elif was[0] > st.st_size:
+                        # truncated, start over
+                        (offset, first) = (0, None)
+                if ident not in seen:
+                    (begin, last) = NTPStats.partrange(logpart, stem,
+                                                       self.starttime,
+                                                       self.endtime)
+                    if self.starttime > last or self.endtime < begin:
+                        continue
+                    # rotated and compressed, or copied, skip what was
+                    # already read
+                    first = NTPStats.firstline(logpart, stem)
+                    offset = firsts.get(first, 0)
+                (part, offset) = NTPStats.readtail(logpart, stem, offset,
+                                                   self.starttime,
+                                                   float('inf'))
+                if first is None:
+                    # written since
+                    first = NTPStats.firstline(logpart, stem)
+            except IOError:
+                sys.stderr.write("ntpviz: WARNING: could not read %s\n"
+                                 % logpart)
+                if logpart in known:
+                    tails[logpart] = known[logpart]
+                continue
+            tails[logpart] = ((st.st_dev, st.st_ino), stamp, offset, first)
+            parts.append(part)
+        self.tails[stem] = tails
+        return StatTable.merge(parts, NTPStats.fieldkinds[stem])
+
+    def refresh(self, endtime=None):
+        "Add the rows logged since the last read, slide the window to endtime."
+        if not self.follow:
+            raise ValueError("refresh() needs an NTPStats in follow mode")
+        if endtime is None:
+            endtime = int(time.time())
+        self.starttime = endtime - (self.endtime - self.starttime)
+        self.endtime = endtime
+        for stem in NTPStats.stems:
+            if stem not in self.__dict__:
+                # not read yet, it will be read whole on first use
+                continue
+            table = StatTable.merge([getattr(self, stem),
+                                     self.readnew(stem)],
+                                    NTPStats.fieldkinds[stem])
+            setattr(self, stem, table.window(self.starttime, self.endtime))
+        # forget the subsets and columns of the old rows
+        self.splits = {}
+        self.columns = {}
+
+    def readstem(self, stem, starttime=None, endtime=None):
+        "Return the rows of all the log parts of a stem, sorted by time."
+        if starttime is None:
+            # the report window
+            if self.follow:
+                table = self.readnew(stem)
+                return table.window(self.starttime, self.endtime)
+            if self.resolution and stem in NTPStats.rollupstems:
+                return self.readrollup(stem)
+            starttime = self.starttime
+            endtime = self.endtime
+
+            if self.memory is not None and stem in NTPStats.rollupstems:
+                return self.readbudget(stem)
+
+        if self.db is not None:
+            # import what is new in the log parts, then ask the database
+            self.db.update(self.statsdir, stem, self.logparts(stem))
+            return self.db.read(self.statsdir, stem, starttime, endtime)
+
+        # each part is sorted by datestamp, merge them
+        return StatTable.merge(list(self.readparts(stem, starttime, endtime)),
+                               NTPStats.fieldkinds[stem])
+
+    def readparts(self, stem, starttime, endtime):
+        "Generate the rows of the log parts of a stem one part at a time."
+        "Oldest first, only the rows from starttime to endtime."
+        if self.db is not None:
+            # a day at a time
+            self.db.update(self.statsdir, stem, self.logparts(stem))
+            while starttime <= endtime:
+                stop = min(endtime, starttime + NTPStats.SecondsInDay)
+                yield self.db.read(self.statsdir, stem, starttime, stop)
+                starttime = stop + 0.0005
+            return
+
+        jobs = []
+        for logpart in self.logparts(stem):
+            # skip files that end before starttime or start after endtime
+            (first, last) = NTPStats.partrange(logpart, stem, starttime,
+                                               endtime)
+            if starttime > last or endtime < first:
+                continue
+            jobs.append((first, logpart))
+        jobs = [(logpart, stem, starttime, endtime, self.cachedir)
+                for (_, logpart) in sorted(jobs)]
+
+        if 1 < self.workers and 1 < len(jobs):
+            # parse and decompress every log part in its own process,
+            # the compact tables come back to be merged here
+            pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+            try:
+                for part in pool.imap(readjob, jobs, 1):
+                    if part is not None:
+                        yield part
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                part = readjob(job)
+                if part is not None:
+                    yield part
+
+    def readbudget(self, stem):
+        "Return the report window of a stem, rolled up if too big."
+        # The log parts are read oldest first.  While their rows fit in
+        # half of what is left of the memory budget, the other half for
+        # the sorted copies and plots, they are kept as by readstem().
+        # Past that the rows read, and the rows of the parts still to
+        # come, are rolled up on the fly, hourly or daily.  The
+        # summaries then come from QuantileSketches of all the rows,
+        # made on the same pass, see summary().
+        kinds = NTPStats.fieldkinds[stem]
+        budget = self.memory // 2 - self.used
+        parts = []
+        size = 0
+        rollup = None
+        for part in self.readparts(stem, self.starttime, self.endtime):
+            if rollup is None:
+                parts.append(part)
+                size += part.nbytes()
+                if size <= budget:
+                    continue
+                # hourly, unless the buckets would not fit either
+                fields = len([x for x in kinds if 'd' == x])
+                sources = 1
+                if 's' == kinds[0]:
+                    sources = len(set(itertools.chain.from_iterable(
+                        [x.sources() for x in parts]))) or 1
+                resolution = 3600
+                if ((self.endtime - self.starttime) / resolution * sources
+                        * 8 * (4 + 4 * fields) > budget):
+                    resolution = NTPStats.SecondsInDay
+                sys.stderr.write("ntpviz: WARNING: %s is over the memory "
+                                 "budget, rolled up by %d seconds\n"
+                                 % (stem, resolution))
+                rollup = Rollup(stem, resolution)
+                sketches = {}
+                rest = StatTable(kinds)
+                (todo, parts) = (parts, None)
+            else:
+                todo = [part]
+            for part in todo:
+                rest = NTPStats.rollpart(rollup, sketches,
+                                         StatTable.merge([rest, part], kinds))
+        if rollup is None:
+            table = StatTable.merge(parts, kinds)
+        else:
+            NTPStats.rollpart(rollup, sketches, rest, True)
+            # log parts that overlap may add buckets out of order
+            rollup.buckets = rollup.buckets.sort()
+            self.budgeted[stem] = (resolution, sketches)
+            table = rollup.view(self.starttime, self.endtime)
+        self.used += table.nbytes()
+        return table
+
+    @staticmethod
+    def rollpart(rollup, sketches, table, last=False):
+        "Roll up the rows of table but those of the last bucket, return them."
+        "And add the rows rolled up to the sketches of each field and source."
+        if not len(table):
+            return table
+        times = table.times
+        cut = len(times)
+        if not last:
+            cut = bisect.bisect_left(times, times[-1] - times[-1]
+                                     % rollup.resolution)
+        done = table.take(range(cut))
+        rollup.add(done, 0)
+        groups = [(None, range(cut))]
+        if rollup.keyed:
+            groups += list(done.sources().items())
+        for fld in rollup.fields:
+            column = done.column(fld)
+            for (source, rows) in groups:
+                if (fld, source) not in sketches:
+                    sketches[(fld, source)] = QuantileSketch()
+                sketches[(fld, source)].extend([column[i] for i in rows])
+        return table.take(range(cut, len(times)))
 
     @staticmethod
     def timestamp(line):
         "get Unix time from converted line."
         return float(line.split()[0])
 
+    def rollup(self, stem, resolution):
+        "Return the rollup of a stem, brought up to the last whole day."
+        # Days close an hour after midnight UTC, for the late lines.
+        # The rollup file is extended with the days closed since the
+        # last run, the first run reads all the log parts.
+        key = (stem, resolution)
+        if key in self.rollups:
+            return self.rollups[key]
+        # one rollupdir may serve several statsdirs
+        digest = hashlib.sha1(os.path.abspath(self.statsdir).encode('utf-8'))
+        path = os.path.join(self.rollupdir, "%s.%d.%s" % (
+            stem, resolution, digest.hexdigest()[:12]))
+        try:
+            with open(path, 'rb') as fp:
+                rollup = Rollup.load(fp)
+        except (IOError, OSError, EOFError, ValueError):
+            # missing or bad, roll up from the start
+            rollup = Rollup(stem, resolution)
+        closed = time.time() - 3600
+        closed -= closed % NTPStats.SecondsInDay
+        if rollup.done < closed:
+            starttime = rollup.done
+            if not starttime:
+                firsts = [NTPStats.partrange(logpart, stem, 0, closed)[0]
+                          for logpart in self.logparts(stem)]
+                # parts with an unknown first time start no earlier
+                starttime = min([t for t in firsts if 0 < t] + [closed])
+                starttime -= starttime % NTPStats.SecondsInDay
+            # a month at a time, to bound the rows in memory
+            while starttime < closed:
+                endtime = min(closed, starttime + 30 * NTPStats.SecondsInDay)
+                rollup.add(self.readstem(stem, starttime, endtime - 0.001),
+                           endtime)
+                starttime = endtime
+            rollup.done = closed
+            try:
+                with open(path + ".tmp", 'wb') as fp:
+                    rollup.dump(fp)
+                os.rename(path + ".tmp", path)
+            except (IOError, OSError):
+                sys.stderr.write("ntpviz: WARNING: could not write %s\n"
+                                 % path)
+        self.rollups[key] = rollup
+        return rollup
+
+    def readrollup(self, stem):
+        "Return the report window of a stem at the rollup resolution."
+        rollup = self.rollup(stem, self.resolution)
+        table = rollup.view(self.starttime, self.endtime)
+        if rollup.done <= self.endtime:
+            # the hours not rolled up yet, from the log parts
+            tail = Rollup(stem, self.resolution)
+            tail.add(self.readstem(stem, max(rollup.done, self.starttime),
+                                   self.endtime), self.endtime)
+            table = StatTable.merge([table, tail.view(self.starttime,
+                                                      self.endtime)],
+                                    NTPStats.fieldkinds[stem])
+        return table
+
     def __init__(self, statsdir, sitename=None,
-                 period=None, starttime=None, endtime=None):
-        "Grab content of logfiles, sorted by timestamp."
+                 period=None, starttime=None, endtime=None, cachedir=None,
+                 workers=1, follow=False, rollupdir=None, points=None,
+                 db=None, memory=None, sketch=False):
+        "Prepare to grab content of logfiles, sorted by timestamp."
         if period is None:
             period = NTPStats.DefaultPeriod
         self.period = period
@@ -85,61 +1570,94 @@ class NTPStats:
                              % statsdir)
             raise SystemExit(1)
 
-        for stem in ("clockstats", "peerstats", "loopstats", "rawstats",
-                     "temps", "gpsd"):
-            lines = []
+        self.statsdir = statsdir
+        self.follow = follow
+        self.tails = {}
+        self.splits = {}        # stem: cached result of splitstem()
+        self.columns = {}       # (stem, fld, source, sort): column()
+        self.workers = workers
+        self.cachedir = cachedir
+        if cachedir is not None and not os.path.isdir(cachedir):
             try:
-                pattern = os.path.join(statsdir, stem)
-                if stem != "temps" and stem != "gpsd":
-                    pattern += "."
-                for logpart in glob.glob(pattern + "*"):
-                    # skip files older than starttime
-                    if starttime > os.path.getmtime(logpart):
-                        continue
-                    if logpart.endswith("gz"):
-                        lines += gzip.open(logpart, 'rt').readlines()
-                    else:
-                        lines += open(logpart, 'r').readlines()
-            except IOError:
-                sys.stderr.write("ntpviz: WARNING: could not read %s\n"
-                                 % logpart)
-                pass
+                os.makedirs(cachedir)
+            except OSError:
+                sys.stderr.write("ntpviz: WARNING: can't create %s, "
+                                 "not caching\n" % cachedir)
+                self.cachedir = None
+        # bytes of rows to keep at most, see readbudget()
+        self.memory = memory
+        self.used = 0
+        # summaries are QuantileSketches, not sorted copies
+        self.sketch = sketch
+        # stem: (resolution, QuantileSketches of the rolled rows)
+        self.budgeted = {}
+        self.db = None
+        if db is not None:
+            if sqlite3 is None:
+                sys.stderr.write("ntpviz: ERROR: no sqlite3 module, "
+                                 "can't use %s\n" % db)
+                raise SystemExit(1)
+            try:
+                self.db = Warehouse(db)
+            except sqlite3.Error as e:
+                sys.stderr.write("ntpviz: ERROR: can't open %s: %s\n"
+                                 % (db, e))
+                raise SystemExit(1)
+        if self.cachedir is None:
+            self.resolver = Resolver()
+        else:
+            self.resolver = Resolver(os.path.join(self.cachedir, "dns"))
 
-            lines1 = []
-            if stem == "temps" or stem == "gpsd":
-                # temps and gpsd are already in UNIX time
-                for line in lines:
-                    split = line.split()
-                    if 3 > len(split):
-                        # skip short lines
-                        continue
+        # With rollups, a long report reads hourly or daily aggregates
+        # where those still give points or more rows, about one per
+        # pixel.  Not in follow mode, which keeps every row.
+        self.rollupdir = rollupdir
+        self.rollups = {}
+        if rollupdir is not None and points and not follow:
+            if not os.path.isdir(rollupdir):
+                try:
+                    os.makedirs(rollupdir)
+                except OSError:
+                    sys.stderr.write("ntpviz: WARNING: can't create %s, "
+                                     "not rolling up\n" % rollupdir)
+                    self.rollupdir = None
+            for resolution in NTPStats.Resolutions:
+                if self.rollupdir is None:
+                    break
+                if points <= (self.endtime - self.starttime) / resolution:
+                    self.resolution = resolution
+                    break
 
-                    try:
-                        t = float(split[0])
-                    except:
-                        # ignore comment lines, lines with no time
-                        continue
+        # The stems are read when first used, see __getattr__()
 
-                    if starttime <= t <= endtime:
-                        # prefix with int milli sec.
-                        split.insert(0, int(t * 1000))
-                        lines1.append(split)
-            else:
-                # Morph first fields into Unix time with fractional seconds
-                # ut into nice dictionary of dictionary rows
-                lines1 = NTPStats.unixize(lines, starttime, endtime)
+    def __getattr__(self, name):
+        "Read a stem on first use, most plots need only one or two."
+        if name in NTPStats.stems:
+            table = self.readstem(name)
+            # cache it, __getattr__ is not called again for this stem
+            setattr(self, name, table)
+            return table
+        raise AttributeError(name)
 
-            # Sort by datestamp
-            # by default, a tuple sort()s on the 1st item, which is a nice
-            # integer of milli seconds.  This is faster than using
-            # cmp= or key=
-            lines1.sort()
-            setattr(self, stem, lines1)
+    def rolledup(self, stem):
+        "Return the seconds each row of stem stands for, 0 for raw rows."
+        if not self.resolution and self.memory is not None:
+            # read, maybe rolled up for the memory budget
+            getattr(self, stem)
+            if stem in self.budgeted:
+                return self.budgeted[stem][0]
+        if stem in NTPStats.rollupstems:
+            return self.resolution
+        return 0
 
     def percentiles(self, percents, values):
         "Return given percentiles of a given row in a given set of entries."
-        "assuming values are already split and sorted"
+        "assuming values are already split and sorted, or a QuantileSketch"
         ret = {}
+        if isinstance(values, QuantileSketch):
+            for perc in percents:
+                ret["p" + str(perc)] = values.quantile(perc / 100)
+            return ret
         length = len(values)
         if 1 >= length:
             # uh, oh...
@@ -159,50 +1677,82 @@ class NTPStats:
                     ret["p" + str(perc)] = values[int(length * (perc/100))]
         return ret
 
+    def splitstem(self, stem):
+        "Return a dictionary mapping the sources of a stem to entry subsets."
+        # field 2 is the source: peer IP or refclock id, gps or
+        # temperature device.  The rows of each source are known from
+        # ingest, this only copies them out, once.
+        if stem not in self.splits:
+            self.splits[stem] = getattr(self, stem).split(2)
+        return self.splits[stem]
+
+    def column(self, stem, fld, source=None):
+        "Return the times and values of field fld of stem, maybe of a source."
+        # Every plot and summary of a column shares the same arrays
+        key = (stem, fld, source, False)
+        if key not in self.columns:
+            if source is None:
+                table = getattr(self, stem)
+            else:
+                table = self.splitstem(stem)[source]
+            self.columns[key] = (table.times, table.column(fld))
+        return self.columns[key]
+
+    def sortedcolumn(self, stem, fld, source=None):
+        "Return the values of field fld of stem, maybe of a source, sorted."
+        # several summaries take the percentiles of the same column,
+        # sort it once
+        key = (stem, fld, source, True)
+        if key not in self.columns:
+            (_, values) = self.column(stem, fld, source)
+            self.columns[key] = array.array('d', sorted(values))
+        return self.columns[key]
+
+    def summary(self, stem, fld, source=None):
+        "Return the values of a field for percentiles(), maybe a sketch."
+        # Sorted values of the rows, or a QuantileSketch of them made
+        # in one pass with sketch.  From rollups a QuantileSketch of
+        # the daily sketches of the window, and of the rows of the day
+        # so far.
+        if not self.resolution and self.memory is not None:
+            # read, maybe rolled up for the memory budget
+            getattr(self, stem)
+            if stem in self.budgeted:
+                return self.budgeted[stem][1].get((fld, source),
+                                                  QuantileSketch())
+        rolled = self.resolution and stem in NTPStats.rollupstems
+        if not rolled and not self.sketch:
+            return self.sortedcolumn(stem, fld, source)
+        key = (stem, fld, source, "summary")
+        if key in self.columns:
+            return self.columns[key]
+        if not rolled:
+            # straight from the rows, no sorted copy is kept
+            (_, values) = self.column(stem, fld, source)
+            sketch = QuantileSketch(values)
+        else:
+            rollup = self.rollup(stem, NTPStats.SecondsInDay)
+            sketch = rollup.sketch(fld, source, self.starttime, self.endtime)
+            if rollup.done <= self.endtime:
+                tail = self.readstem(stem, max(rollup.done, self.starttime),
+                                     self.endtime)
+                if source is not None:
+                    tail = tail.split(2).get(source, StatTable(tail.kinds))
+                sketch.merge(QuantileSketch(tail.column(fld)))
+        self.columns[key] = sketch
+        return sketch
+
     def peersplit(self):
         "Return a dictionary mapping peerstats IPs to entry subsets."
-        "This is very expensive, so cache the result"
-        if len(self.peermap):
-            return self.peermap
-
-        for row in self.peerstats:
-            try:
-                ip = row[2]     # peerstats field 2, refclock id
-                if ip not in self.peermap:
-                    self.peermap[ip] = []
-                self.peermap[ip].append(row)
-            except IndexError:
-                # ignore corrupted rows
-                pass
-        return self.peermap
+        return self.splitstem("peerstats")
 
     def gpssplit(self):
         "Return a dictionary mapping gps sources to entry subsets."
-        gpsmap = {}
-        for row in self.gpsd:
-            try:
-                source = row[2]
-                if source not in gpsmap:
-                    gpsmap[source] = []
-                gpsmap[source].append(row)
-            except IndexError:
-                # ignore corrupted rows
-                pass
-        return gpsmap
+        return self.splitstem("gpsd")
 
     def tempssplit(self):
         "Return a dictionary mapping temperature sources to entry subsets."
-        tempsmap = {}
-        for row in self.temps:
-            try:
-                source = row[2]
-                if source not in tempsmap:
-                    tempsmap[source] = []
-                tempsmap[source].append(row)
-            except IndexError:
-                # ignore corrupted rows
-                pass
-        return tempsmap
+        return self.splitstem("temps")
 
     def ip_label(self, key):
         "Produce appropriate label for an IP address."
@@ -219,13 +1769,73 @@ class NTPStats:
                 return "REFCLOCK(type=%s,unit=%s)" % (t, u)
             # Ordinary IP address - replace with primary hostname.
             # Punt if the lookup fails.
-            try:
-                (hostname, _, _) = socket.gethostbyaddr(key)
+            hostname = self.resolver.answer('name', key)
+            if hostname is not None:
                 return hostname
-            except socket.herror:
-                pass
         return key      # Someday, be smarter than this.
 
+    def resolve(self, keys=None):
+        "Look up the hostnames of peers at once, default all, for ip_label()."
+        if keys is None:
+            keys = self.peersplit().keys()
+        self.resolver.resolve([('name', key) for key in keys
+                               if key[0].isdigit()
+                               and not key.startswith("127.127.")])
+
+
+def readjob(job):
+    "Return the rows of one log part for NTPStats.readstem(), or None."
+    # A plain function, so that multiprocessing can run it in a worker.
+    (logpart, stem, starttime, endtime, cachedir) = job
+    try:
+        if cachedir is None:
+            return NTPStats.readpart(logpart, stem, starttime, endtime)
+        part = NTPStats.readcached(logpart, stem, cachedir)
+        return part.window(starttime, endtime)
+    except IOError:
+        sys.stderr.write("ntpviz: WARNING: could not read %s\n" % logpart)
+        return None
+
+
+def decimate(times, columns, buckets, gap=2200):
+    "Return the indices of the rows worth plotting, None for a line break."
+    # Time is cut into buckets, about one per pixel.  In each bucket
+    # the first, last, smallest and largest value of each column are
+    # kept, so the plotted line covers the same pixels as with all the
+    # rows.  Rows more than gap seconds apart break the line, the
+    # breaks come from all rows, not just the kept ones.
+    picks = []
+    if not len(times):
+        return picks
+    # runs of rows with no gap
+    starts = [i for i in range(1, len(times))
+              if gap < times[i] - times[i - 1]]
+    starts = [0] + starts + [len(times)]
+    if len(times) <= 4 * buckets or times[-1] == times[0]:
+        # few rows, or all in the same second: no buckets, keep all
+        for r in range(len(starts) - 1):
+            picks.append(None)
+            picks.extend(range(starts[r], starts[r + 1]))
+        return picks
+
+    first = times[0]
+    width = (times[-1] - first) / buckets
+    for r in range(len(starts) - 1):
+        picks.append(None)
+        lo = starts[r]
+        end = starts[r + 1]
+        while lo < end:
+            edge = first + width * (int((times[lo] - first) / width) + 1)
+            hi = max(bisect.bisect_left(times, edge, lo, end), lo + 1)
+            keep = set([lo, hi - 1])
+            for column in columns:
+                values = column[lo:hi]
+                keep.add(lo + values.index(min(values)))
+                keep.add(lo + values.index(max(values)))
+            picks.extend(sorted(keep))
+            lo = hi
+    return picks
+
 
 def iso_to_posix(s):
     "Accept timestamps in ISO 8661 format or numeric POSIX time. UTC only."
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""
+svgplot.py - draw the gnuplot programs of ntpviz as SVG, without gnuplot
+
+ntpviz writes every plot as a small gnuplot program.  render() draws
+the part of gnuplot those programs use straight to SVG, in process:
+
+    set terminal png size W,H     set title, xlabel, ylabel
+    set xdata time                set xrange, yrange, y2range
+    set xtics, ytics, y2tics format
+    set key off                   set grid
+    set style line N lc rgb C     set boxwidth
+    set arrow from X,graph A to X,graph B
+    set label N "text" at X, graph Y
+    $name << EOD datablocks
+
+and plot commands of "-" inline data, datablocks and constants, with
+using expressions of the columns, drawn with lines, linespoints or
+boxes, on axes x1y1 or x1y2.  Other commands are ignored.
+"""
+# SPDX-License-Identifier: BSD-2-Clause
+from __future__ import print_function, division
+
+import math
+import re
+import time
+
+# the default line colors of gnuplot 5
+Colors = ("#9400d3", "#009e73", "#56b4e9", "#e69f00",
+          "#f0e442", "#0072b2", "#e51e10", "#000000")
+
+# seconds between ticks of a time axis
+TimeSteps = (60, 120, 300, 600, 900, 1800, 3600, 2 * 3600, 3 * 3600,
+             6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400, 14 * 86400,
+             28 * 86400, 91 * 86400, 365 * 86400)
+
+# words that end the constant of a plot element
+Keywords = ("title", "notitle", "with", "using", "ls", "lt", "lw", "axis",
+            "axes")
+
+
+def unquote(text):
+    "Return the quoted string that starts text, and the rest of text."
+    text = text.lstrip()
+    quote = text[:1]
+    if quote not in ('"', "'"):
+        raise ValueError("no string in %r" % text)
+    chars = []
+    i = 1
+    while i < len(text):
+        c = text[i]
+        if c == quote:
+            return (''.join(chars), text[i + 1:])
+        if '\\' == c and '"' == quote and i + 1 < len(text):
+            # escapes only in double quotes, as in gnuplot
+            i += 1
+            c = {'n': '\n', 't': '\t'}.get(text[i], text[i])
+        chars.append(c)
+        i += 1
+    # gnuplot forgives a missing quote at the end of a line
+    return (''.join(chars), '')
+
+
+def uncomment(line):
+    "Return line without its # comment, if any."
+    quote = None
+    for (i, c) in enumerate(line):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif '#' == c:
+            return line[:i]
+    return line
+
+
+def split(text, sep):
+    "Split text at each sep outside quotes and parentheses."
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for (i, c) in enumerate(text):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif '(' == c:
+            depth += 1
+        elif ')' == c:
+            depth -= 1
+        elif c == sep and 0 == depth:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def function(expr):
+    "Return a function of a row of numbers computing a using column."
+    expr = expr.strip()
+    if re.match(r"^\d+$", expr):
+        column = int(expr) - 1
+        return lambda v: v[column]
+    expr = re.sub(r"\$(\d+)", lambda m: "v[%d]" % (int(m.group(1)) - 1),
+                  expr)
+    # arithmetic only, this is evaluated
+    if not re.match(r"^[\d\s.eE+\-*/()v\[\]]+$", expr):
+        raise ValueError("can't draw using %r" % expr)
+    try:
+        return eval("lambda v: " + expr, {"__builtins__": {}})
+    except Exception:
+        # SyntaxError, or worse
+        raise ValueError("can't draw using %r" % expr)
+
+
+def constant(expr):
+    "Return the value of a constant plot element."
+    if not re.match(r"^[\d\s.eE+\-*/()]+$", expr):
+        raise ValueError("can't plot %r" % expr)
+    try:
+        return float(eval(expr, {"__builtins__": {}}))
+    except Exception:
+        # a bare e is a NameError, 1/0 a ZeroDivisionError
+        raise ValueError("can't plot %r" % expr)
+
+
+def ticks(lo, hi, count):
+    "Return round values from lo to hi, about count of them."
+    span = hi - lo
+    step = 10 ** math.floor(math.log10(span / count))
+    for m in (1, 2, 5, 10):
+        if span / (step * m) <= count:
+            step *= m
+            break
+    # rounded to the digits of step, so no 0.6000000000000001 or -0
+    digits = max(0, 1 - int(math.floor(math.log10(step))))
+    values = []
+    n = int(math.ceil(lo / step - 1e-9))
+    while n * step <= hi + step * 1e-9:
+        values.append(round(n * step, digits) + 0.0)
+        n += 1
+    return values
+
+
+def timeticks(lo, hi, count):
+    "Return whole times from lo to hi, about count of them."
+    for step in TimeSteps:
+        if (hi - lo) / step <= count:
+            break
+    first = int(math.ceil(lo / step)) * step
+    return list(range(first, int(hi) + 1, step))
+
+
+def escape(text):
+    "Return text ready for SVG."
+    return text.replace('&', "&amp;").replace('<', "&lt;") \
+               .replace('>', "&gt;").replace('"', "&quot;")
+
+
+class Series:
+    "One element of a plot command."
+
+    def __init__(self, title, kind, axis, style):
+        self.title = title
+        self.kind = kind        # 'lines', 'boxes' or 'constant'
+        self.axis = axis        # 'y' or 'y2'
+        self.style = style      # line style number, or None
+        self.segments = []      # lists of (x, y), a gap between two
+        self.value = None       # y of a constant
+
+
+class Plot:
+    "The settings and series of a gnuplot program."
+
+    def __init__(self):
+        self.size = (640, 480)
+        self.title = ''
+        self.xlabel = ''
+        self.ylabel = ''
+        self.timex = False
+        self.grid = False
+        self.key = True
+        self.formats = {'x': "%g", 'y': "%g", 'y2': None}
+        self.ranges = {'x': (None, None), 'y': (None, None),
+                       'y2': (None, None)}
+        self.styles = {}        # line style number: color
+        self.boxwidth = None
+        self.arrows = []        # x, from and to in graph fractions
+        self.labels = []        # text, x, y in graph fraction, color
+        self.series = []
+
+    def set(self, text):
+        "Obey a set command, text is what follows set."
+        m = re.match(r"terminal\s+\w+.*\bsize\s+(\d+)\s*,\s*(\d+)", text)
+        if m:
+            self.size = (int(m.group(1)), int(m.group(2)))
+            return
+        m = re.match(r"(title|xlabel|ylabel)\s+(.*)", text)
+        if m:
+            setattr(self, m.group(1), unquote(m.group(2))[0])
+            return
+        if re.match(r"xdata\s+time", text):
+            self.timex = True
+        elif re.match(r"grid\b", text):
+            self.grid = True
+        elif re.match(r"key\s+off", text):
+            self.key = False
+        m = re.match(r"(x|y|y2)tics\s+format\s+(.*)", text)
+        if m:
+            self.formats[m.group(1)] = unquote(m.group(2))[0]
+            return
+        m = re.match(r"(x|y|y2)range\s*\[([^:\]]*):([^\]]*)\]", text)
+        if m:
+            bounds = []
+            for bound in m.group(2, 3):
+                bound = bound.strip()
+                if bound in ('', '*'):
+                    bounds.append(None)
+                else:
+                    bounds.append(float(bound))
+            self.ranges[m.group(1)] = tuple(bounds)
+            return
+        m = re.match(r"(?:style\s+line|linestyle)\s+(\d+)\s.*?"
+                     r"(?:lc|linecolor)\s+rgb\s+['\"](#\w+)", text)
+        if m:
+            self.styles[int(m.group(1))] = m.group(2)
+            return
+        m = re.match(r"boxwidth\s+(\S+)", text)
+        if m:
+            self.boxwidth = float(m.group(1))
+            return
+        m = re.match(r"arrow\s+from\s+([^,]+),\s*graph\s+(\S+)\s+"
+                     r"to\s+[^,]+,\s*graph\s+(\S+)", text)
+        if m:
+            self.arrows.append(tuple(float(x) for x in m.group(1, 2, 3)))
+            return
+        m = re.match(r"label\s+\d+\s+(.*)", text)
+        if m:
+            (label, rest) = unquote(m.group(1))
+            m = re.match(r"\s*at\s+([^,]+),\s*graph\s+(\S+)", rest)
+            if m:
+                color = re.search(r"textcolor\s+rgb\s+['\"](#\w+)", rest)
+                self.labels.append((label, float(m.group(1)),
+                                    float(m.group(2)),
+                                    color.group(1) if color else "#000000"))
+
+    def plot(self, text, lines, i, blocks):
+        "Obey a plot command, reading its inline data from lines[i:]."
+        "Return the index of the line after the data."
+        for element in split(text, ','):
+            element = element.strip()
+            if not element:
+                continue
+            rest = element
+            source = None
+            if rest[:1] in "\"'":
+                (source, rest) = unquote(rest)
+            elif '$' == rest[:1]:
+                m = re.match(r"\$(\w+)(.*)", rest)
+                (source, rest) = ('$' + m.group(1), m.group(2))
+            else:
+                words = rest.split()
+                n = 0
+                while n < len(words) and words[n] not in Keywords:
+                    n += 1
+                value = constant(" ".join(words[:n]))
+                rest = " ".join(words[n:])
+
+            using = None
+            m = re.search(r"\busing\s+", rest)
+            if m:
+                spec = split(rest[m.end():], ' ')[0]
+                using = [function(x) for x in split(spec, ':')]
+            title = ''
+            m = re.search(r"\btitle\s+", rest)
+            if m:
+                title = unquote(rest[m.end():])[0]
+            kind = 'lines'
+            if re.search(r"\bwith\s+boxes", rest):
+                kind = 'boxes'
+            style = re.search(r"\bls\s+(\d+)", rest)
+            if style:
+                style = int(style.group(1))
+            axis = 'y'
+            if re.search(r"\bax[ie]s\s+x1y2", rest):
+                axis = 'y2'
+            series = Series(title, kind, axis, style)
+            self.series.append(series)
+
+            if source is None:
+                series.kind = 'constant'
+                series.value = value
+                continue
+            if '-' == source:
+                data = []
+                while i < len(lines) and 'e' != lines[i].strip():
+                    data.append(lines[i])
+                    i += 1
+                i += 1
+            elif source in blocks:
+                data = blocks[source]
+            else:
+                raise ValueError("can't plot %s" % source)
+            if using is None:
+                using = [function("1"), function("2")]
+            segment = []
+            for line in data:
+                values = line.split()
+                if not values:
+                    if segment:
+                        series.segments.append(segment)
+                        segment = []
+                    continue
+                try:
+                    row = [float(x) for x in values]
+                    segment.append((using[0](row), using[1](row)))
+                except (ValueError, IndexError, ZeroDivisionError):
+                    # like gnuplot, skip what does not compute
+                    continue
+                except Exception:
+                    # the using expression itself is wrong, a bare
+                    # e or v is a NameError on every row
+                    raise ValueError("can't plot %s" % element)
+            if segment:
+                series.segments.append(segment)
+        return i
+
+    def extent(self, axis):
+        "Return the range of an axis, as set or from the data."
+        (lo, hi) = self.ranges[axis]
+        if lo is None or hi is None:
+            values = []
+            for series in self.series:
+                if 'x' == axis:
+                    if 'constant' != series.kind:
+                        for segment in series.segments:
+                            values.extend([x for (x, _) in segment])
+                elif series.axis == axis:
+                    if 'constant' == series.kind:
+                        values.append(series.value)
+                    for segment in series.segments:
+                        values.extend([y for (_, y) in segment])
+            if 'boxes' in [x.kind for x in self.series] and 'x' != axis:
+                values.append(0.0)
+            if values:
+                if lo is None:
+                    lo = min(values)
+                if hi is None:
+                    hi = max(values)
+            else:
+                if lo is None:
+                    lo = 0.0
+                if hi is None:
+                    hi = lo + 1
+        if lo == hi:
+            (lo, hi) = (lo - 1, hi + 1)
+        return (lo, hi)
+
+    def svg(self):
+        "Return the plot drawn as SVG."
+        (width, height) = self.size
+        y2 = self.formats['y2'] is not None
+        left = 80
+        right = width - (80 if y2 else 30)
+        top = 40
+        bottom = height - (70 if self.xlabel else 50)
+        (x0, x1) = self.extent('x')
+        scales = {'y': self.extent('y')}
+        if y2:
+            scales['y2'] = self.extent('y2')
+
+        def px(x):
+            return left + (x - x0) * (right - left) / (x1 - x0)
+
+        def py(y, axis='y'):
+            (lo, hi) = scales.get(axis, scales['y'])
+            return bottom - (y - lo) * (bottom - top) / (hi - lo)
+
+        out = ['<?xml version="1.0" encoding="UTF-8"?>',
+               '<svg xmlns="http://www.w3.org/2000/svg" width="%d" '
+               'height="%d" viewBox="0 0 %d %d" font-family="sans-serif" '
+               'font-size="12">' % (width, height, width, height),
+               '<rect width="100%" height="100%" fill="white"/>',
+               '<clipPath id="area"><rect x="%d" y="%d" width="%d" '
+               'height="%d"/></clipPath>' % (left, top, right - left,
+                                             bottom - top)]
+        if self.title:
+            out.append('<text x="%d" y="24" text-anchor="middle" '
+                       'font-size="14">%s</text>'
+                       % (width // 2, escape(self.title)))
+
+        # axes, ticks and grid
+        count = max(2, (right - left) // 120)
+        if self.timex:
+            xticks = timeticks(x0, x1, count)
+        else:
+            xticks = ticks(x0, x1, count)
+        for x in xticks:
+            if self.timex:
+                label = time.strftime(self.formats['x'], time.gmtime(x))
+            else:
+                label = self.formats['x'] % x
+            out.append(self.tick(px(x), bottom, label, 'x', top))
+        for axis in sorted(scales):
+            (lo, hi) = scales[axis]
+            for y in ticks(lo, hi, max(2, (bottom - top) // 60)):
+                out.append(self.tick(py(y, axis), left if 'y' == axis
+                                     else right,
+                                     self.formats[axis] % y, axis,
+                                     right if 'y' == axis else None))
+        out.append('<rect x="%d" y="%d" width="%d" height="%d" '
+                   'fill="none" stroke="black"/>'
+                   % (left, top, right - left, bottom - top))
+        if self.xlabel:
+            out.append('<text x="%d" y="%d" text-anchor="middle">%s</text>'
+                       % ((left + right) // 2, height - 10,
+                          escape(self.xlabel)))
+        if self.ylabel:
+            out.append('<text transform="translate(16,%d) rotate(-90)" '
+                       'text-anchor="middle">%s</text>'
+                       % ((top + bottom) // 2, escape(self.ylabel)))
+
+        # the data, clipped to the plot area
+        out.append('<g clip-path="url(#area)" fill="none" '
+                   'stroke-width="1">')
+        keys = []
+        for (n, series) in enumerate(self.series):
+            color = self.styles.get(series.style, Colors[n % len(Colors)])
+            if series.title:
+                keys.append((series.title, color))
+            if 'constant' == series.kind:
+                y = py(series.value, series.axis)
+                out.append('<path d="M%d %.1fH%d" stroke="%s"/>'
+                           % (left, y, right, color))
+            elif 'boxes' == series.kind:
+                base = py(max(0.0, scales['y'][0]))
+                for segment in series.segments:
+                    for (x, y) in segment:
+                        w = 1.0
+                        if self.boxwidth is not None:
+                            w = max(w, self.boxwidth * (right - left)
+                                    / (x1 - x0))
+                        top_y = min(py(y), base)
+                        out.append('<rect x="%.1f" y="%.1f" width="%.1f" '
+                                   'height="%.1f" fill="%s" '
+                                   'fill-opacity="0.5" stroke="%s"/>'
+                                   % (px(x) - w / 2, top_y, w,
+                                      abs(base - py(y)), color, color))
+            else:
+                for segment in series.segments:
+                    points = " ".join(["%.1f,%.1f" % (px(x),
+                                                      py(y, series.axis))
+                                       for (x, y) in segment])
+                    out.append('<polyline points="%s" stroke="%s"/>'
+                               % (points, color))
+        for (x, lo, hi) in self.arrows:
+            out.append('<path d="M%.1f %.1fV%.1f" stroke="black"/>'
+                       % (px(x), bottom - lo * (bottom - top),
+                          bottom - hi * (bottom - top)))
+        out.append('</g>')
+        for (label, x, y, color) in self.labels:
+            out.append('<text x="%.1f" y="%.1f" fill="%s">%s</text>'
+                       % (px(x), bottom - y * (bottom - top), color,
+                          escape(label)))
+
+        if self.key:
+            for (n, (title, color)) in enumerate(keys):
+                y = top + 16 + 16 * n
+                out.append('<text x="%d" y="%d" text-anchor="end">%s</text>'
+                           '<path d="M%d %dh30" stroke="%s" '
+                           'stroke-width="2"/>'
+                           % (right - 46, y + 4, escape(title),
+                              right - 40, y, color))
+        out.append('</svg>\n')
+        return "\n".join(out)
+
+    def tick(self, pos, edge, label, axis, other):
+        "Return a tick, its label, and its grid line to other, as SVG."
+        lines = label.split('\n')
+        if 'x' == axis:
+            svg = ('<path d="M%.1f %dv-6" stroke="black"/>'
+                   '<text x="%.1f" y="%d" text-anchor="middle">'
+                   % (pos, edge, pos, edge + 16))
+            for (n, line) in enumerate(lines):
+                svg += '<tspan x="%.1f" dy="%d">%s</tspan>' % (
+                    pos, 14 if n else 0, escape(line))
+            svg += '</text>'
+            if self.grid:
+                svg += ('<path d="M%.1f %dV%d" stroke="#c0c0c0" '
+                        'stroke-dasharray="2,3"/>' % (pos, edge, other))
+            return svg
+        if 'y' == axis:
+            svg = ('<path d="M%d %.1fh6" stroke="black"/>'
+                   '<text x="%d" y="%.1f" text-anchor="end">%s</text>'
+                   % (edge, pos, edge - 6, pos + 4, escape(lines[0])))
+            if self.grid:
+                svg += ('<path d="M%d %.1fH%d" stroke="#c0c0c0" '
+                        'stroke-dasharray="2,3"/>' % (edge, pos, other))
+            return svg
+        return ('<path d="M%d %.1fh-6" stroke="black"/>'
+                '<text x="%d" y="%.1f">%s</text>'
+                % (edge, pos, edge + 6, pos + 4, escape(lines[0])))
+
+
+def parse(program):
+    "Return the Plot of a gnuplot program."
+    if isinstance(program, bytes):
+        program = program.decode('utf-8')
+    plot = Plot()
+    blocks = {}
+    lines = program.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        m = re.match(r"\s*(\$\w+)\s*<<\s*(\w+)\s*$", line)
+        if m:
+            data = []
+            while i < len(lines) and lines[i].strip() != m.group(2):
+                data.append(lines[i])
+                i += 1
+            i += 1
+            blocks[m.group(1)] = data
+            continue
+        while line.rstrip().endswith('\\') and i < len(lines):
+            line = line.rstrip()[:-1] + lines[i]
+            i += 1
+        line = uncomment(line).strip()
+        if line.startswith("set "):
+            plot.set(line[4:].strip())
+        elif line.startswith("plot "):
+            i = plot.plot(line[5:], lines, i, blocks)
+    return plot
+
+
+def render(program):
+    "Return the SVG drawing of an ntpviz gnuplot program."
+    # raises ValueError on a plot it can't draw
+    return parse(program).svg()
+
+# end
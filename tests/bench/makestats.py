@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""\
+makestats.py - write a directory of synthetic NTP statistics files
+
+usage: makestats.py [-d DAYS] [-p PEERS] [-P POLL] [-z DAYS] [-s SEED] DIR
+
+Writes loopstats, peerstats, rawstats and clockstats as daily filegen
+parts (stem.YYYYMMDD), and temps and gpsd rotated the logrotate way
+(temps, temps.1, temps.2.gz, ...), for DAYS days up to now.  Parts
+older than -z DAYS are gzipped.  The values wander plausibly, from a
+seeded generator, so the same arguments always give the same files.
+
+Used by ntpviz-bench.py, also handy for trying ntpviz without a server.
+"""
+# SPDX-License-Identifier: BSD-2-Clause
+from __future__ import print_function, division
+
+import argparse
+import gzip
+import math
+import os
+import random
+import time
+
+SecondsInDay = 24 * 60 * 60
+MJDUnixEpoch = 40587    # MJD of 1970-01-01
+
+
+def openpart(path, compress):
+    "Open a log part for writing text, gzipped if compress."
+    if compress:
+        return gzip.open(path + ".gz", 'wt')
+    return open(path, 'w')
+
+
+def makestats(statsdir, days=7, peers=4, poll=64, gzipafter=1, seed=1,
+              endtime=None):
+    "Write days of statistics up to endtime, default now, in statsdir."
+    rand = random.Random(seed)
+    if endtime is None:
+        endtime = int(time.time())
+    if not os.path.isdir(statsdir):
+        os.makedirs(statsdir)
+    addrs = ["192.168.%d.%d" % (1 + i // 250, 1 + i % 250)
+             for i in range(peers - 1)] + ["127.127.28.0"]
+    # per peer offset bias and delay
+    bias = [rand.gauss(0, 2e-4) for _ in addrs]
+    delay = [rand.uniform(1e-3, 5e-2) for _ in addrs]
+    freq = -15.0
+    temp = 40.0
+
+    firstday = endtime - endtime % SecondsInDay - days * SecondsInDay
+    for day in range(days + 1):
+        daystart = firstday + day * SecondsInDay
+        age = days - day
+        compress = age > gzipafter
+        name = time.strftime("%Y%m%d", time.gmtime(daystart))
+        mjd = daystart // SecondsInDay + MJDUnixEpoch
+        if age:
+            rotated = ".%d" % age
+        else:
+            rotated = ""
+
+        loop = openpart(os.path.join(statsdir, "loopstats." + name),
+                        compress)
+        peer = openpart(os.path.join(statsdir, "peerstats." + name),
+                        compress)
+        raw = openpart(os.path.join(statsdir, "rawstats." + name), compress)
+        clock = openpart(os.path.join(statsdir, "clockstats." + name),
+                         compress)
+        try:
+            for second in range(0, SecondsInDay, poll):
+                if daystart + second > endtime:
+                    break
+                # diurnal temperature drives the frequency
+                phase = 2 * math.pi * second / SecondsInDay
+                freq += rand.gauss(0, 1e-3) + 1e-4 * math.sin(phase)
+                offset = rand.gauss(0, 5e-6)
+                loop.write("%d %.3f %.9f %.3f %.9f %.6f %d\n" % (
+                    mjd, second, offset, freq, abs(rand.gauss(0, 1e-6)),
+                    abs(rand.gauss(0, 1e-3)), 6))
+                for (i, addr) in enumerate(addrs):
+                    t = second + rand.random()
+                    peer.write("%d %.3f %s 9414 %.9f %.9f %.9f %.9f\n" % (
+                        mjd, t, addr, bias[i] + rand.gauss(0, 1e-4),
+                        delay[i] + abs(rand.gauss(0, 1e-4)),
+                        abs(rand.gauss(1e-3, 1e-4)),
+                        abs(rand.gauss(0, 2e-5))))
+                    if addr.startswith("127.127."):
+                        continue
+                    ntp = daystart + t + 2208988800
+                    raw.write("%d %.3f 10.0.0.1 %s %.9f %.9f %.9f %.9f "
+                              "0 2 2 1 10 -20 0.000000 0.000000 "
+                              ".GPS. 0 4294967295\n" % (
+                                  mjd, t, addr, ntp, ntp + delay[i] / 2,
+                                  ntp + delay[i] / 2 + 1e-5,
+                                  ntp + delay[i]))
+                if 0 == second % 16:
+                    clock.write("%d %.3f 127.127.28.0 $GPRMC,%s,A\n" % (
+                        mjd, second, time.strftime(
+                            "%H%M%S", time.gmtime(daystart + second))))
+        finally:
+            loop.close()
+            peer.close()
+            raw.close()
+            clock.close()
+
+        temps = openpart(os.path.join(statsdir, "temps" + rotated), compress)
+        gpsd = openpart(os.path.join(statsdir, "gpsd" + rotated), compress)
+        try:
+            for second in range(0, SecondsInDay, 60):
+                t = daystart + second
+                if t > endtime:
+                    break
+                phase = 2 * math.pi * second / SecondsInDay
+                temp += rand.gauss(0, 0.05) + 0.01 * math.sin(phase)
+                temps.write("%d ZONE0 %.1f\n%d ZONE1 %.1f\n" % (
+                    t, temp, t, temp - 5 + rand.gauss(0, 0.2)))
+                gpsd.write("%d /dev/ttyS0 %.2f %d\n" % (
+                    t, abs(rand.gauss(1.0, 0.2)), rand.randint(6, 12)))
+        finally:
+            temps.close()
+            gpsd.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="write synthetic NTP statistics files")
+    parser.add_argument('statsdir',
+                        help="directory to write to, created if needed")
+    parser.add_argument('-d', '--days', default=7, type=int,
+                        help="days of statistics, before today")
+    parser.add_argument('-p', '--peers', default=4, type=int,
+                        help="peers in peerstats, the last a refclock")
+    parser.add_argument('-P', '--poll', default=64, type=int,
+                        help="seconds between loopstats and peerstats lines")
+    parser.add_argument('-z', '--gzip-after', default=1, type=int,
+                        dest='gzipafter',
+                        help="gzip the parts more than this many days old")
+    parser.add_argument('-s', '--seed', default=1, type=int,
+                        help="seed of the random values")
+    args = parser.parse_args()
+    makestats(args.statsdir, days=args.days, peers=args.peers,
+              poll=args.poll, gzipafter=args.gzipafter, seed=args.seed)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""\
+ntpviz-bench.py - time ntp.statfiles and ntpviz on synthetic statistics
+
+usage: ntpviz-bench.py [-d DAYS] [-p PEERS] [-P POLL] [-r REPEAT]
+                       [--statsdir DIR] [--gnuplot]
+                       [--save FILE] [--baseline FILE] [--tolerance X]
+
+Writes DAYS of statistics with makestats.py, then times, each in a
+fresh process:
+
+  ingest-STEM   NTPStats reading one stem, for each stem
+  peersplit     splitting peerstats by peer
+  plot_slice    the gnuplot data of loopstats and of each peer
+  vizstats      the summary of the loopstats offsets
+  report        a whole ntpviz report, as a separate command
+
+and prints the best wall time of REPEAT runs, and the peak RSS, of
+each.  gnuplot is replaced by a program that only reads its input,
+so the report time is ntpviz's own, unless --gnuplot is given.
+
+--save writes the results as JSON.  --baseline compares them with
+saved results and exits 1 if anything got slower by more than the
+--tolerance factor, so a CI job can catch regressions in the hot
+loops.
+"""
+# SPDX-License-Identifier: BSD-2-Clause
+from __future__ import print_function, division
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+try:
+    import resource
+except ImportError:
+    # no peak RSS then
+    resource = None
+
+try:
+    import ntp.statfiles
+except ImportError as e:
+    sys.stderr.write(
+        "ntpviz-bench: can't find Python NTP library -- "
+        "check PYTHONPATH.\n")
+    sys.stderr.write("%s\n" % e)
+    sys.exit(1)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import makestats    # noqa: E402
+
+NTPViz = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "..", "..", "ntpclients", "ntpviz")
+
+
+def peakrss(who):
+    "Return the peak resident set size of who, in MB, or None."
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes, not kB
+        rss /= 1024
+    return rss / 1024
+
+
+def loadntpviz():
+    "Return ntpviz as a module, set up as for a default report."
+    module = types.ModuleType("ntpviz")
+    module.__file__ = NTPViz
+    with open(NTPViz) as fp:
+        code = compile(fp.read(), NTPViz, 'exec')
+    exec(code, module.__dict__)
+    module.args = argparse.Namespace(png_size='1340,720', clip=False,
+                                     quantiles='exact', debug_level=0)
+    return module
+
+
+def newstats(statsdir, days):
+    "Return an NTPStats of the whole generated directory."
+    return ntp.statfiles.NTPStats(statsdir, sitename="bench",
+                                  period=(days + 1) * 86400)
+
+
+def bench_ingest(statsdir, days, stem):
+    "Read one stem."
+    stats = newstats(statsdir, days)
+    return len(getattr(stats, stem))
+
+
+def bench_peersplit(statsdir, days):
+    "Split the peerstats by peer, after reading them."
+    stats = newstats(statsdir, days)
+    stats.peerstats
+    start = time.time()
+    stats.peersplit()
+    return start
+
+
+def bench_plot_slice(statsdir, days):
+    "Make the gnuplot data of loopstats and of each peer."
+    ntpviz = loadntpviz()
+    stats = ntpviz.NTPViz(statsdir, sitename="bench",
+                          period=(days + 1) * 86400)
+    peers = stats.peersplit()
+    start = time.time()
+    stats.plot_slice(stats.loopstats, 2, 3)
+    for peer in peers.values():
+        stats.plot_slice(peer, 4)
+    return start
+
+
+def bench_vizstats(statsdir, days):
+    "Summarize the loopstats offsets."
+    ntpviz = loadntpviz()
+    stats = newstats(statsdir, days)
+    values = stats.loopstats.column(2)
+    start = time.time()
+    ntpviz.VizStats(values, "Local Clock Time Offset")
+    return start
+
+
+def bench_report(statsdir, days, bindir):
+    "Make a whole report with ntpviz, gnuplot from bindir."
+    outdir = tempfile.mkdtemp()
+    devnull = open(os.devnull, 'w')
+    env = dict(os.environ)
+    if bindir is not None:
+        env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+    try:
+        subprocess.check_call([sys.executable, NTPViz, "-d", statsdir,
+                               "-p", str(days + 1), "-o", outdir],
+                              env=env, stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+        shutil.rmtree(outdir)
+
+
+def runone(queue, func, fargs):
+    "Run a benchmark in this process, put its time and peak RSS on queue."
+    start = time.time()
+    # a benchmark may return when its timed part started
+    began = func(*fargs)
+    if not isinstance(began, float):
+        began = start
+    took = time.time() - began
+    if func is bench_report:
+        rss = peakrss(resource.RUSAGE_CHILDREN) if resource else None
+    else:
+        rss = peakrss(resource.RUSAGE_SELF) if resource else None
+    queue.put((took, rss))
+
+
+def run(func, fargs, repeat):
+    "Return the best time and the peak RSS of repeat runs of func."
+    best = None
+    peak = None
+    for _ in range(repeat):
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=runone,
+                                        args=(queue, func, fargs))
+        child.start()
+        (took, rss) = queue.get()
+        child.join()
+        if best is None or took < best:
+            best = took
+        if rss is not None:
+            peak = max(peak or 0, rss)
+    return (best, peak)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="time ntp.statfiles and ntpviz on synthetic statistics")
+    parser.add_argument('-d', '--days', default=7, type=int,
+                        help="days of statistics to generate")
+    parser.add_argument('-p', '--peers', default=4, type=int,
+                        help="peers in peerstats")
+    parser.add_argument('-P', '--poll', default=64, type=int,
+                        help="seconds between loopstats and peerstats lines")
+    parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help="runs of each benchmark, the best counts")
+    parser.add_argument('--statsdir', default=None,
+                        help="use or make the statistics here, and keep them")
+    parser.add_argument('--gnuplot', action="store_true",
+                        help="run the real gnuplot in the report")
+    parser.add_argument('--save', default=None,
+                        help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=None,
+                        help="compare with results saved by --save")
+    parser.add_argument('--tolerance', default=1.25, type=float,
+                        help="slowdown against the baseline that fails")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    statsdir = args.statsdir
+    if statsdir is None:
+        statsdir = os.path.join(tmpdir, "stats")
+    bindir = None
+    if not args.gnuplot:
+        bindir = os.path.join(tmpdir, "bin")
+        os.mkdir(bindir)
+        with open(os.path.join(bindir, "gnuplot"), "w") as fp:
+            fp.write("#!/bin/sh\ncat \"$1\" >/dev/null\n")
+        os.chmod(os.path.join(bindir, "gnuplot"), 0o755)
+
+    try:
+        if not os.path.isdir(statsdir):
+            start = time.time()
+            makestats.makestats(statsdir, days=args.days, peers=args.peers,
+                                poll=args.poll)
+            print("made %d days of statistics in %.2f s" % (
+                args.days, time.time() - start))
+
+        benchmarks = [("ingest-" + stem, bench_ingest,
+                       (statsdir, args.days, stem))
+                      for stem in ntp.statfiles.NTPStats.stems]
+        benchmarks += [
+            ("peersplit", bench_peersplit, (statsdir, args.days)),
+            ("plot_slice", bench_plot_slice, (statsdir, args.days)),
+            ("vizstats", bench_vizstats, (statsdir, args.days)),
+            ("report", bench_report, (statsdir, args.days, bindir)),
+        ]
+        results = {}
+        print("%-18s %10s %10s" % ("benchmark", "seconds", "peak MB"))
+        for (name, func, fargs) in benchmarks:
+            (took, rss) = run(func, fargs, args.repeat)
+            results[name] = {"seconds": took, "rss": rss}
+            if rss is None:
+                rss = float('nan')
+            print("%-18s %10.3f %10.1f" % (name, took, rss))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.save is not None:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        slower = []
+        for (name, result) in sorted(results.items()):
+            if name not in baseline:
+                continue
+            was = baseline[name]["seconds"]
+            if result["seconds"] > was * args.tolerance:
+                slower.append("%s: %.3f s, was %.3f s" % (
+                    name, result["seconds"], was))
+        if slower:
+            sys.stderr.write("ntpviz-bench: slower than the baseline:\n  ")
+            sys.stderr.write("\n  ".join(slower) + "\n")
+            sys.exit(1)
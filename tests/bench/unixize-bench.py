@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""\
+unixize-bench.py - time the ways ntp.statfiles reads a peerstats file
+
+Writes a synthetic peerstats file, then reads it once with the
+line-by-line NTPStats.unixize() loop and once with the NumPy
+NTPStats.readvector() path, if NumPy is there, and reports the
+wall time and rate of each.
+
+usage: unixize-bench.py [-n LINES] [-p PEERS] [-f FILE]
+
+The default is a 10 million line file in a temporary directory,
+removed afterwards; -f keeps (or reuses) it.
+"""
+# SPDX-License-Identifier: BSD-2-Clause
+from __future__ import print_function, division
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import ntp.statfiles
+except ImportError as e:
+    sys.stderr.write(
+        "unixize-bench: can't find Python NTP library -- "
+        "check PYTHONPATH.\n")
+    sys.stderr.write("%s\n" % e)
+    sys.exit(1)
+
+
+def make_peerstats(path, lines, peers):
+    "Write lines of plausible peerstats, peers interleaved, 16s apart."
+    mjd = 57728
+    second = 0.0
+    with open(path, "w") as fp:
+        for i in range(lines):
+            peer = i % peers
+            if 0 == peer:
+                second += 16.0 / peers
+                if 86400 <= second:
+                    mjd += 1
+                    second -= 86400
+            fp.write("%d %.3f 192.168.%d.%d 9414 %.9f %.9f %.9f %.9f\n" % (
+                mjd, second, peer // 250, 1 + peer % 250,
+                1e-4 * (i % 97 - 48), 0.01 + 1e-5 * (i % 13),
+                0.002 + 1e-6 * (i % 31), 1e-5 * (i % 7)))
+
+
+def timed(label, func, lines):
+    "Run func, report its wall time, return its table."
+    start = time.time()
+    table = func()
+    took = time.time() - start
+    print("%-10s %8.2f s %12.0f lines/s %10d rows" % (
+        label, took, lines / took, len(table)))
+    return table
+
+
+parser = argparse.ArgumentParser(
+    description="time the peerstats readers of ntp.statfiles")
+parser.add_argument('-n', '--lines', default=10000000, type=int,
+                    help="lines of peerstats to read")
+parser.add_argument('-p', '--peers', default=8, type=int,
+                    help="number of peers in the file")
+parser.add_argument('-f', '--file', default=None,
+                    help="peerstats file to use, made if missing")
+args = parser.parse_args()
+
+tmpdir = None
+path = args.file
+if path is None:
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "peerstats")
+try:
+    if not os.path.exists(path):
+        start = time.time()
+        make_peerstats(path, args.lines, args.peers)
+        print("wrote %d lines in %.2f s" % (args.lines, time.time() - start))
+
+    stats = ntp.statfiles.NTPStats
+    starttime, endtime = 0, 2 ** 31
+
+    def loop():
+        lines = stats.readlines(path)
+        table = ntp.statfiles.StatTable(stats.fieldkinds["peerstats"])
+        return stats.unixize(lines, starttime, endtime, table).sort()
+
+    slow = timed("unixize", loop, args.lines)
+    if not stats.vectorize:
+        print("numpy      not available (needs NumPy 1.23 or later)")
+    else:
+        fast = timed("numpy", lambda: stats.readvector(
+            path, "peerstats", starttime, endtime), args.lines)
+        if list(fast.times) != list(slow.times):
+            sys.stderr.write("unixize-bench: the readers disagree!\n")
+            sys.exit(1)
+finally:
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir)
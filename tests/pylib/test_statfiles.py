@@ -1,9 +1,22 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import gzip
+import os
+import shutil
+import tempfile
+import time
 import unittest
 import ntp.statfiles
 
+# 2016-12-06T04:49:46 is MJD 57728, 17386 seconds past midnight
+loopstats_lines = [
+    "57728 17386.000 0.000001234 -15.123 0.000000456 0.002 6\n",
+    "57728 17402.000 -0.000000789 -15.124 0.000000321 0.003 6\n",
+    "# comment line\n",
+    "57728 17418.000 0.000000555 -15.125 0.000000222 0.001 6\n",
+]
+
 
 class TestPylibStatfilesMethods(unittest.TestCase):
 
@@ -17,6 +30,31 @@ class TestPylibStatfilesMethods(unittest.TestCase):
         self.assertEqual(ntp.statfiles.posix_to_iso(1480999786),
                          "2016-12-06T04:49:46")
 
+    def test_decimate(self):
+        decimate = ntp.statfiles.decimate
+        self.assertEqual(decimate([], [[]], 10), [])
+        # few rows: all kept, gaps break the line
+        times = [0.0, 100.0, 200.0, 5000.0]
+        self.assertEqual(decimate(times, [[1, 2, 3, 4]], 10),
+                         [None, 0, 1, 2, None, 3])
+        # 1000 rows, 10 buckets: first, last, min and max of each
+        times = [float(i) for i in range(1000)]
+        values = [(i * 37) % 101 for i in range(1000)]
+        picks = decimate(times, [values], 10)
+        self.assertEqual(picks[0], None)
+        self.assertEqual(picks[1], 0)
+        self.assertEqual(picks[-1], 999)
+        self.assertTrue(40 >= len(picks) - 1)
+        self.assertEqual(picks[1:], sorted(picks[1:]))
+        self.assertTrue(values.index(100) in picks)
+        self.assertTrue(values.index(0) in picks)
+        # buckets wider than the gap do not break the line
+        times = [60.0 * i for i in range(1000)]
+        self.assertEqual(decimate(times, [values], 2).count(None), 1)
+        # a burst in the same second has no span to cut
+        self.assertEqual(decimate([5.0] * 1000, [values], 10),
+                         [None] + list(range(1000)))
+
     def test_iso_to_posix_inverts_posix_to_iso(self):
         self.assertEqual(ntp.statfiles.iso_to_posix(
             ntp.statfiles.posix_to_iso(1480999786)), 1480999786)
@@ -26,5 +64,638 @@ class TestPylibStatfilesMethods(unittest.TestCase):
             ntp.statfiles.iso_to_posix("2016-12-06T04:49:46")),
             "2016-12-06T04:49:46")
 
+
+class TestPylibStatfilesStatTable(unittest.TestCase):
+
+    def test_columns(self):
+        table = ntp.statfiles.StatTable("ssdt")
+        split = "57728 17386.0 10.0.0.1 9014 0.5 some text  here\n"
+        table.append(1480999786.0, split.split(None, table.maxsplit(2)), 2)
+        table.append(1480999790.0, "57728 17390.0 10.0.0.2".split(), 2)
+        table.append(1480999780.0, "57728 17380.0 10.0.0.2 9014 x".split(), 2)
+        table.append(1480999782.0, "57728 17382.0 10.0.0.2 a 1".split(), 2)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.column(2), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(list(table.column(4)), [0.5, 1.0])
+        self.assertEqual(table.column(5), ["some text  here", ""])
+
+    def test_sort_and_split(self):
+        table = ntp.statfiles.StatTable("sd")
+        for (t, source, value) in ((3.0, "b", 30.0), (1.0, "a", 10.0),
+                                   (2.0, "b", 20.0), (1.0, "b", 11.0)):
+            table.append(t, [str(t), source, str(value)], 1)
+        table = table.sort()
+        self.assertEqual(list(table.times), [1.0, 1.0, 2.0, 3.0])
+        self.assertEqual(list(table.column(3)), [10.0, 11.0, 20.0, 30.0])
+        subsets = table.split(2)
+        self.assertEqual(list(subsets["b"].times), [1.0, 2.0, 3.0])
+        self.assertEqual(list(subsets["a"].column(3)), [10.0])
+
+    def test_merge(self):
+        def table(rows):
+            table = ntp.statfiles.StatTable("s")
+            for (t, name) in rows:
+                table.append(t, [str(t), name], 1)
+            return table
+
+        merge = ntp.statfiles.StatTable.merge
+        # parts that follow each other
+        merged = merge([table([(3.0, "c"), (4.0, "d")]),
+                        table([]),
+                        table([(1.0, "a"), (2.0, "b"), (3.0, "b")])], "s")
+        self.assertEqual(list(merged.times), [1.0, 2.0, 3.0, 3.0, 4.0])
+        self.assertEqual(merged.column(2), ["a", "b", "b", "c", "d"])
+        # overlapping parts
+        merged = merge([table([(1.0, "a"), (5.0, "e")]),
+                        table([(2.0, "b"), (3.0, "c"), (6.0, "f")]),
+                        table([(2.0, "x")])], "s")
+        self.assertEqual(list(merged.times), [1.0, 2.0, 2.0, 3.0, 5.0, 6.0])
+        self.assertEqual(merged.column(2), ["a", "b", "x", "c", "e", "f"])
+        self.assertEqual(len(merge([], "s")), 0)
+
+    def test_sources(self):
+        def table(rows):
+            table = ntp.statfiles.StatTable("sd")
+            for (t, name) in rows:
+                table.append(t, [str(t), name, "0"], 1)
+            return table
+
+        merged = ntp.statfiles.StatTable.merge(
+            [table([(3.0, "b"), (4.0, "a")]),
+             table([(1.0, "a"), (2.0, "b")])], "sd")
+        # kept up through the merge, no second pass
+        self.assertEqual(dict((k, list(v)) for (k, v) in merged.index.items()),
+                         {"a": [0, 3], "b": [1, 2]})
+        window = merged.window(2.0, 4.0)
+        self.assertEqual(dict((k, list(v)) for (k, v) in window.index.items()),
+                         {"a": [2], "b": [0, 1]})
+        self.assertEqual(list(window.split(2)["b"].times), [2.0, 3.0])
+        # made anew when lost
+        window.index = None
+        self.assertEqual(list(window.sources()["a"]), [2])
+
+
+class TestPylibStatfilesQuantileSketch(unittest.TestCase):
+
+    def test_quantiles(self):
+        values = [((i * 7919) % 10007) / 10.0 for i in range(10007)]
+        ordered = sorted(values)
+        sketch = ntp.statfiles.QuantileSketch(values)
+        self.assertEqual(len(sketch), 10007)
+        self.assertTrue(1000 > sum([len(x) for x in sketch.levels]))
+        self.assertEqual(sketch.quantile(0), 0.0)
+        self.assertEqual(sketch.quantile(1), 1000.6)
+        for q in (0.01, 0.05, 0.5, 0.95, 0.99):
+            rank = ordered.index(sketch.quantile(q))
+            self.assertTrue(abs(rank - q * 10007) < 0.01 * 10007)
+        self.assertAlmostEqual(sketch.mean(), sum(values) / 10007)
+        # stems are read on first use, none here
+        stats = ntp.statfiles.NTPStats(tempfile.gettempdir(),
+                                       sitename="test")
+        percs = stats.percentiles((100, 50, 0), sketch)
+        self.assertEqual(percs["p0"], 0.0)
+        self.assertEqual(percs["p100"], 1000.6)
+
+    def test_merge(self):
+        values = [float((i * 37) % 1000) for i in range(5000)]
+        whole = ntp.statfiles.QuantileSketch(values)
+        merged = ntp.statfiles.QuantileSketch()
+        for start in range(0, 5000, 1000):
+            merged.merge(ntp.statfiles.QuantileSketch(
+                values[start:start + 1000]))
+        self.assertEqual(len(merged), 5000)
+        self.assertEqual((merged.min, merged.max), (0.0, 999.0))
+        self.assertAlmostEqual(merged.mean(), whole.mean())
+        self.assertAlmostEqual(merged.pstdev(), whole.pstdev())
+        self.assertTrue(abs(merged.quantile(0.5) - 500) < 10)
+        self.assertEqual(ntp.statfiles.QuantileSketch().quantile(0.5), 0)
+
+
+class TestPylibStatfilesResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.lookup = ntp.statfiles.Resolver.__dict__["lookup"]
+        self.asked = []
+
+        def lookup(query):
+            self.asked.append(query)
+            if query[1] == "10.0.0.9":
+                time.sleep(0.5)
+            if query[1] == "10.0.0.2":
+                return None
+            return "host-" + query[1]
+        ntp.statfiles.Resolver.lookup = staticmethod(lookup)
+
+    def tearDown(self):
+        ntp.statfiles.Resolver.lookup = self.lookup
+        shutil.rmtree(self.cachedir)
+
+    def test_resolve(self):
+        cachefile = os.path.join(self.cachedir, "dns")
+        resolver = ntp.statfiles.Resolver(cachefile)
+        resolver.Timeout = 0.1
+        queries = [('name', "10.0.0.%d" % i) for i in (1, 2, 9)]
+        resolver.resolve(queries)
+        self.assertEqual(resolver.answer('name', "10.0.0.1"), "host-10.0.0.1")
+        self.assertEqual(resolver.answer('name', "10.0.0.2"), None)
+        # timed out, not asked again for a while
+        self.assertEqual(resolver.answer('name', "10.0.0.9"), None)
+        resolver.resolve(queries)
+        self.assertEqual(len(self.asked), 3)
+
+        # the answers outlive the resolver
+        resolver = ntp.statfiles.Resolver(cachefile)
+        resolver.resolve(queries[:2])
+        self.assertEqual(len(self.asked), 3)
+        self.assertEqual(resolver.answer('name', "10.0.0.1"), "host-10.0.0.1")
+        self.assertEqual(resolver.answer('name', "10.0.0.2"), None)
+        # until they expire
+        resolver.answers[queries[0]] = ("old", 0)
+        resolver.resolve(queries[:2])
+        self.assertEqual(resolver.answer('name', "10.0.0.1"), "host-10.0.0.1")
+        self.assertEqual(len(self.asked), 4)
+
+
+class TestPylibStatfilesIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.statsdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.statsdir)
+
+    def write_part(self, name, lines, mtime=None):
+        path = os.path.join(self.statsdir, name)
+        if name.endswith(".gz"):
+            logfile = gzip.open(path, 'wt')
+        else:
+            logfile = open(path, 'w')
+        logfile.writelines(lines)
+        logfile.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_readlines_streams(self):
+        path = self.write_part("loopstats.20161205.gz", loopstats_lines)
+        lines = ntp.statfiles.NTPStats.readlines(path)
+        self.assertFalse(isinstance(lines, list))
+        self.assertEqual(list(lines), loopstats_lines)
+
+    def test_readers(self):
+        data = "".join(loopstats_lines).encode('ascii')
+        writers = [("loopstats.1", open)]
+        if ntp.statfiles.bz2 is not None:
+            writers.append(("loopstats.2.bz2", ntp.statfiles.bz2.BZ2File))
+        if ntp.statfiles.lzma is not None:
+            writers.append(("loopstats.3.xz", ntp.statfiles.lzma.open))
+        # gzipped, but not named so
+        writers.append(("loopstats.4", gzip.open))
+        for (name, opener) in writers:
+            path = os.path.join(self.statsdir, name)
+            logfile = opener(path, 'wb')
+            logfile.write(data)
+            logfile.close()
+            self.assertEqual(list(ntp.statfiles.NTPStats.readlines(path)),
+                             loopstats_lines)
+        self.assertEqual(ntp.statfiles.NTPStats.uncompressed("a/b.1.gz"),
+                         "a/b.1")
+        self.assertEqual(ntp.statfiles.NTPStats.uncompressed("a/b.1"), None)
+
+    def test_readlines_window(self):
+        lines = ["%d ZONE0 %d.0\n" % (1480999786 + i, i) for i in range(100)]
+        path = os.path.join(self.statsdir, "temps.1")
+        logfile = gzip.open(path, 'wb')
+        logfile.write("".join(lines).encode('ascii'))
+        logfile.close()
+        chunksize = ntp.statfiles.NTPStats.ChunkSize
+        try:
+            # each chunk a bit over four lines
+            ntp.statfiles.NTPStats.ChunkSize = 100
+            got = list(ntp.statfiles.NTPStats.readlines(
+                path, "temps", 1480999786 + 40, 1480999786 + 50))
+        finally:
+            ntp.statfiles.NTPStats.ChunkSize = chunksize
+        # whole chunks, around the window, with no line cut
+        self.assertTrue(len(got) < 25)
+        self.assertEqual(got, lines[lines.index(got[0]):][:len(got)])
+        self.assertTrue(got[0] <= lines[40] and lines[50] <= got[-1])
+        table = ntp.statfiles.NTPStats.readpart(
+            path, "temps", 1480999786 + 40, 1480999786 + 50)
+        self.assertEqual(list(table.column(3)), [float(i)
+                                                 for i in range(40, 51)])
+
+    def test_ingest_filters_window(self):
+        self.write_part("loopstats.20161206.gz", loopstats_lines[:2])
+        self.write_part("loopstats.1", loopstats_lines[2:])
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999786,
+                                       endtime=1480999802)
+        self.assertEqual(list(stats.loopstats.times),
+                         [1480999786.0, 1480999802.0])
+        self.assertEqual(stats.loopstats.column(2)[1], -0.000000789)
+        self.assertEqual(len(stats.peerstats), 0)
+
+    def test_column(self):
+        self.write_part("temps", ["1480999786 ZONE0 41.5\n",
+                                  "1480999790 ZONE1 30.0\n",
+                                  "1480999796 ZONE0 39.0\n"])
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481000000)
+        (times, values) = stats.column("temps", 3)
+        self.assertEqual(list(values), [41.5, 30.0, 39.0])
+        self.assertTrue(values is stats.column("temps", 3)[1])
+        (times, values) = stats.column("temps", 3, "ZONE0")
+        self.assertEqual(list(times), [1480999786.0, 1480999796.0])
+        self.assertEqual(list(stats.sortedcolumn("temps", 3, "ZONE0")),
+                         [39.0, 41.5])
+        self.assertTrue(stats.sortedcolumn("temps", 3) is
+                        stats.sortedcolumn("temps", 3))
+        # sketched from the rows as they are, nothing sorted is kept
+        sketched = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                          starttime=1480999700,
+                                          endtime=1481000000, sketch=True)
+        sketch = sketched.summary("temps", 3, "ZONE0")
+        self.assertTrue(isinstance(sketch, ntp.statfiles.QuantileSketch))
+        self.assertEqual((sketch.min, sketch.max), (39.0, 41.5))
+        self.assertTrue(sketch is sketched.summary("temps", 3, "ZONE0"))
+        self.assertFalse([key for key in sketched.columns if key[3] is True])
+
+    def test_db(self):
+        if ntp.statfiles.sqlite3 is None:
+            self.skipTest("no sqlite3")
+        db = os.path.join(self.statsdir, "db", "stats.db")
+        os.mkdir(os.path.dirname(db))
+        lines = ["%d 10.0.0.%d %d.5 9\n" % (1480999786 + i, i % 2, i)
+                 for i in range(6)]
+        self.write_part("temps", ["1480999786 ZONE0 41.5\n"])
+        path = self.write_part("gpsd", lines[:3])
+
+        def read():
+            stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                           starttime=1480999700,
+                                           endtime=1481000000, db=db)
+            return list(stats.gpsd.times)
+        self.assertEqual(read(), [1480999786.0 + i for i in range(3)])
+        # appended, then rotated and compressed: nothing twice
+        with open(path, 'a') as logfile:
+            logfile.writelines(lines[3:5])
+        self.assertEqual(read(), [1480999786.0 + i for i in range(5)])
+        os.remove(path)
+        self.write_part("gpsd.1.gz", lines[:6])
+        self.write_part("gpsd", ["1480999800 10.0.0.9 1.0 9\n"])
+        self.assertEqual(read(), [1480999786.0 + i for i in range(6)]
+                         + [1480999800.0])
+        warehouse = ntp.statfiles.Warehouse(db)
+        table = warehouse.read(self.statsdir, "gpsd", 1480999787, 1481000000,
+                               "10.0.0.1")
+        self.assertEqual(list(table.times), [1480999787.0, 1480999789.0,
+                                             1480999791.0])
+        self.assertEqual(list(table.column(3)), [1.5, 3.5, 5.5])
+        self.assertEqual(len(warehouse.read("/nonesuch", "temps", 0,
+                                            1481000000)), 0)
+
+    def test_memory_budget(self):
+        # two days of gpsd, a row a minute
+        start = 1480982400
+        for (name, day) in (("gpsd.1", 0), ("gpsd", 1)):
+            self.write_part(name, ["%d /dev/ttyS0 %d.0 9\n"
+                                   % (start + 86400 * day + 60 * i, i % 100)
+                                   for i in range(1440)])
+
+        def stats(memory):
+            return ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                          starttime=start,
+                                          endtime=start + 2 * 86400 - 1,
+                                          memory=memory)
+        roomy = stats(1 << 30)
+        self.assertEqual(len(roomy.gpsd), 2880)
+        self.assertEqual(len(roomy.summary("gpsd", 3)), 2880)
+
+        tight = stats(1 << 14)
+        # hourly means at the middle of each hour
+        self.assertEqual(len(tight.gpsd), 48)
+        self.assertEqual(tight.gpsd.times[0], start + 1800.0)
+        self.assertEqual(tight.gpsd.column(3)[0], 29.5)
+        self.assertTrue(tight.used < 1 << 13)
+        sketch = tight.summary("gpsd", 3)
+        self.assertTrue(isinstance(sketch, ntp.statfiles.QuantileSketch))
+        self.assertEqual(len(sketch), 2880)
+        self.assertEqual((sketch.min, sketch.max), (0.0, 99.0))
+        self.assertAlmostEqual(sketch.mean(),
+                               sum(roomy.gpsd.column(3)) / 2880)
+        self.assertEqual(len(tight.summary("gpsd", 3, "/dev/ttyS0")), 2880)
+        # plotted as ntpviz does, the hourly rows make one line
+        self.assertEqual(roomy.rolledup("gpsd"), 0)
+        self.assertEqual(tight.rolledup("gpsd"), 3600)
+        gap = max(2200, 2 * tight.rolledup("gpsd"))
+        picks = ntp.statfiles.decimate(tight.gpsd.times,
+                                       [tight.gpsd.column(3)], 600, gap)
+        self.assertEqual(picks, [None] + list(range(48)))
+
+    def test_memory_budget_peers(self):
+        # a day of two peers, offsets far from their hourly means
+        lines = ["57728 %d.0 10.0.0.%d 9014 %d.0 0.1 0.2 0.3\n"
+                 % (30 * i, i % 2, (i * 7) % 101 - 50)
+                 for i in range(2880)]
+        self.write_part("peerstats.20161206", lines)
+
+        def stats(memory):
+            return ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                          starttime=1480982400,
+                                          endtime=1481068799,
+                                          memory=memory)
+        roomy = stats(1 << 30)
+        tight = stats(1 << 14)
+        self.assertTrue(len(tight.peerstats) < len(roomy.peerstats))
+        percents = (100, 99, 50, 1, 0)
+        for peer in ("10.0.0.0", "10.0.0.1"):
+            exact = roomy.percentiles(percents,
+                                      roomy.summary("peerstats", 4, peer))
+            sketch = tight.summary("peerstats", 4, peer)
+            self.assertTrue(isinstance(sketch,
+                                       ntp.statfiles.QuantileSketch))
+            self.assertEqual(len(sketch), 1440)
+            sketched = tight.percentiles(percents, sketch)
+            for perc in percents:
+                self.assertTrue(abs(sketched["p%d" % perc] -
+                                    exact["p%d" % perc]) <= 1.0)
+
+    def test_rollups(self):
+        # two days of temps, 2016-12-06 and 07, every 10 minutes
+        lines = ["%d ZONE%d %.1f\n" % (1480982400 + 600 * i, i % 2, i % 50)
+                 for i in range(288)]
+        self.write_part("temps", lines)
+        rollupdir = os.path.join(self.statsdir, "rollups")
+
+        def stats(points):
+            return ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                          starttime=1480982400,
+                                          endtime=1481155199,
+                                          rollupdir=rollupdir, points=points)
+
+        self.assertEqual(stats(None).resolution, 0)
+        self.assertEqual(stats(1).resolution, 86400)
+        hourly = stats(40)
+        self.assertEqual(hourly.resolution, 3600)
+        # one row per hour and source, at the middle of the hour
+        self.assertEqual(len(hourly.temps), 96)
+        self.assertEqual(hourly.temps[0][:3],
+                         [1480984200000, "1480984200.0", "ZONE0"])
+        # ZONE0 logs 0, 2 and 4 in the first hour
+        self.assertEqual(hourly.temps[0][3], 2.0)
+        self.assertEqual(sorted(os.listdir(rollupdir))[0][:11],
+                         "temps.3600.")
+        # percentiles from the daily sketches
+        summary = hourly.summary("temps", 3, "ZONE1")
+        self.assertEqual(len(summary), 144)
+        self.assertEqual((summary.min, summary.max), (1.0, 49.0))
+        raw = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                     starttime=1480982400,
+                                     endtime=1481155199)
+        self.assertEqual(raw.summary("temps", 3, "ZONE1"),
+                         raw.sortedcolumn("temps", 3, "ZONE1"))
+        self.assertAlmostEqual(summary.mean(),
+                               sum(raw.temps.column(3)[1::2]) / 144)
+        # read again from the rollup files, not the log
+        os.remove(os.path.join(self.statsdir, "temps"))
+        self.assertEqual(len(stats(40).temps), 96)
+
+    def test_splits_are_per_instance(self):
+        self.write_part("temps", ["1480999786 ZONE0 39.0\n"])
+        first = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481000000)
+        self.assertEqual(list(first.tempssplit().keys()), ["ZONE0"])
+        self.write_part("temps", ["1480999796 ZONE1 41.5\n"])
+        second = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                        starttime=1480999700,
+                                        endtime=1481000000)
+        self.assertEqual(list(second.tempssplit().keys()), ["ZONE1"])
+        self.assertTrue(first.tempssplit() is first.tempssplit())
+
+    def test_partrange(self):
+        partrange = ntp.statfiles.NTPStats.partrange
+        # written up to the end of the day, compressed a bit later
+        day = self.write_part("loopstats.20161206.gz", loopstats_lines,
+                              1481070000)
+        self.assertEqual(partrange(day, "loopstats", 0, 2e9),
+                         (1480982400, 1481068799.999))
+        month = self.write_part("peerstats.201612", [], 1481070000)
+        self.assertEqual(partrange(month, "peerstats", 0, 2e9),
+                         (1480550400, 1481070000))
+        year = self.write_part("peerstats.2016", [], 1483228000)
+        self.assertEqual(partrange(year, "peerstats", 0, 2e9),
+                         (1451606400, 1483228000))
+        # filegen pid names, the mtime is far from the name's times
+        for name in ("loopstats.1012", "loopstats.201612"):
+            pid = self.write_part(name, loopstats_lines)
+            self.assertEqual(partrange(pid, "loopstats", 0, 2e9),
+                             (1480999786, 1480999818))
+        # no date in the name, look at the lines
+        plain = self.write_part("loopstats.1", loopstats_lines)
+        self.assertEqual(partrange(plain, "loopstats", 0, 2e9),
+                         (1480999786, 1480999818))
+        packed = self.write_part("loopstats.2.gz", loopstats_lines)
+        (first, last) = partrange(packed, "loopstats", 0, 2e9)
+        self.assertEqual(first, 1480999786)
+        self.assertEqual(last, os.path.getmtime(packed))
+        # too old to look at
+        self.assertEqual(partrange(plain, "loopstats", 3e9, 4e9)[0],
+                         float('-inf'))
+
+    def test_ingest_skips_parts_out_of_range(self):
+        self.write_part("loopstats.20161205", loopstats_lines[:1],
+                        1480982399)
+        # lines that do not belong to the day of the name are not read
+        self.write_part("loopstats.20161207", loopstats_lines[1:],
+                        1481155199)
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480982400,
+                                       endtime=1481068799)
+        self.assertEqual(len(stats.loopstats), 0)
+        # but those of a filegen pid part are
+        self.write_part("loopstats.1012", loopstats_lines[:1])
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480982400,
+                                       endtime=1481068799)
+        self.assertEqual(len(stats.loopstats), 1)
+
+    def test_ingest_is_lazy(self):
+        self.write_part("loopstats.20161206", loopstats_lines)
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481000000)
+        self.assertFalse("loopstats" in stats.__dict__)
+        self.assertEqual(len(stats.loopstats), 3)
+        self.assertTrue("loopstats" in stats.__dict__)
+        self.assertFalse("rawstats" in stats.__dict__)
+        self.assertRaises(AttributeError, getattr, stats, "nosuchstats")
+
+    def test_ingest_workers(self):
+        self.write_part("loopstats.20161206.gz", loopstats_lines[:2])
+        self.write_part("loopstats.1", loopstats_lines[2:])
+        serial = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                        starttime=1480999700,
+                                        endtime=1481000000)
+        parallel = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                          starttime=1480999700,
+                                          endtime=1481000000, workers=2)
+        self.assertEqual(len(parallel.loopstats), 3)
+        self.assertEqual(parallel.loopstats.times, serial.loopstats.times)
+        self.assertEqual(parallel.loopstats.column(3),
+                         serial.loopstats.column(3))
+
+    def test_follow(self):
+        path = self.write_part("loopstats.20161206", loopstats_lines[:1])
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481068900, follow=True)
+        self.assertEqual(len(stats.loopstats), 1)
+        self.assertRaises(ValueError, ntp.statfiles.NTPStats(
+            self.statsdir, sitename="test").refresh)
+
+        # a line still being written is left for the next refresh
+        with open(path, 'a') as fp:
+            fp.write(loopstats_lines[1] + loopstats_lines[3][:10])
+        stats.refresh(1481068900)
+        self.assertEqual(list(stats.loopstats.times),
+                         [1480999786.0, 1480999802.0])
+
+        # finish the line, then rotate and compress the log part
+        with open(path, 'a') as fp:
+            fp.write(loopstats_lines[3][10:])
+        with open(path) as fp:
+            self.write_part("loopstats.20161206.gz", fp.readlines())
+        os.remove(path)
+        self.write_part("loopstats.20161207", [
+            "57729 10.000 0.000001 -15.1 0.000000456 0.002 6\n"])
+        stats.refresh(1481068900)
+        self.assertEqual(list(stats.loopstats.times),
+                         [1480999786.0, 1480999802.0, 1480999818.0,
+                          1481068810.0])
+
+        # nothing new, the window slides on
+        stats.refresh(1481138000)
+        self.assertEqual(list(stats.loopstats.times), [1481068810.0])
+        self.assertEqual(stats.starttime, 1481068800)
+
+    def test_follow_logrotate(self):
+        def day(n):
+            return ["%d ZONE0 %d.0\n" % (1480982400 + 86400 * n + 60 * i, n)
+                    for i in range(10)]
+
+        def rotate(lines):
+            # temps.1 to temps.2.gz, temps to temps.1, a new temps
+            path = os.path.join(self.statsdir, "temps.1")
+            if os.path.exists(path):
+                with open(path) as fp:
+                    self.write_part("temps.2.gz", fp.readlines())
+                os.remove(path)
+            os.rename(os.path.join(self.statsdir, "temps"), path)
+            self.write_part("temps", lines)
+
+        self.write_part("temps", day(0))
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480982400,
+                                       endtime=1481328000, follow=True)
+        self.assertEqual(len(stats.temps), 10)
+        rotate(day(1))
+        stats.refresh(1481328000)
+        self.assertEqual(len(stats.temps), 20)
+        # temps.1 is compressed to temps.2.gz, a new inode and name
+        rotate(day(2))
+        stats.refresh(1481328000)
+        self.assertEqual(list(stats.temps.column(3)),
+                         [0.0] * 10 + [1.0] * 10 + [2.0] * 10)
+        # or compressed right away, temps to temps.1.gz
+        with open(os.path.join(self.statsdir, "temps")) as fp:
+            self.write_part("temps.1.gz", fp.readlines())
+        os.remove(os.path.join(self.statsdir, "temps"))
+        os.remove(os.path.join(self.statsdir, "temps.1"))
+        self.write_part("temps", day(3))
+        stats.refresh(1481328000)
+        self.assertEqual(list(stats.temps.column(3)),
+                         [0.0] * 10 + [1.0] * 10 + [2.0] * 10 + [3.0] * 10)
+
+    def test_ingest_unix_time_stems(self):
+        self.write_part("temps", ["1480999786 ZONE0 39.0\n",
+                                  "# Time Device Temp\n",
+                                  "1480999790 ZONE1\n",
+                                  "1480999796 ZONE1 41.5\n"])
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481000000)
+        self.assertEqual([stats.temps[0], stats.temps[1]],
+                         [[1480999786000, "1480999786.0", "ZONE0", 39.0],
+                          [1480999796000, "1480999796.0", "ZONE1", 41.5]])
+        self.assertEqual(sorted(stats.tempssplit().keys()),
+                         ["ZONE0", "ZONE1"])
+
+    @unittest.skipUnless(ntp.statfiles.vectorize, "needs NumPy 1.23")
+    def test_readvector(self):
+        path = self.write_part("peerstats", [
+            "57728 17390.000 10.0.0.1 9014 0.002 0.0 0.001 0.0002\n",
+            "# a comment\n",
+            "57728 17386.000 127.127.28.0 9014 0.001 0.02 0.003 0.0004\n",
+            "57728 99999.000 10.0.0.1 9014 0.002 0.0 0.001 0.0002\n"])
+        stats = ntp.statfiles.NTPStats
+        fast = stats.readvector(path, "peerstats", 1480999700, 1481000000)
+        slow = stats.unixize(stats.readlines(path), 1480999700, 1481000000,
+                             ntp.statfiles.StatTable("ssdddd")).sort()
+        self.assertEqual([fast[i] for i in range(len(fast))],
+                         [slow[i] for i in range(len(slow))])
+        self.assertEqual(len(fast), 2)
+        # an odd line makes readpart() fall back to the loop
+        with open(path, "a") as fp:
+            fp.write("57728 17400.000 10.0.0.1\n")
+        self.assertRaises(ValueError, stats.readvector, path, "peerstats",
+                          1480999700, 1481000000)
+        self.assertEqual(len(stats.readpart(path, "peerstats", 1480999700,
+                                            1481000000)), 2)
+
+    def test_cache(self):
+        cachedir = os.path.join(self.statsdir, "cache")
+        path = self.write_part("peerstats.20161206", [
+            "57728 17386.000 10.0.0.1 9014 0.001 0.02 0.003 0.0004\n",
+            "57728 17390.000 127.127.28.0 9014 0.002 0.0 0.001 0.0002\n"])
+        # a whole second, that os.utime() keeps on Python 2 too
+        os.utime(path, (1481000000, 1481000000))
+        stats = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                       starttime=1480999700,
+                                       endtime=1481000000,
+                                       cachedir=cachedir)
+        self.assertEqual(len(stats.peerstats), 2)
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+        cachefile = os.path.join(cachedir, os.listdir(cachedir)[0])
+        with open(cachefile, 'rb') as fp:
+            fp.readline()
+            table = ntp.statfiles.StatTable.load(fp)
+        self.assertEqual(table.column(2), ["10.0.0.1", "127.127.28.0"])
+        self.assertEqual(list(table.column(7)), [0.0004, 0.0002])
+
+        # a cached part is not parsed again, even when it would not parse
+        st = os.stat(path)
+        with open(path, 'w') as fp:
+            fp.write("x" * (st.st_size - 1) + "\n")
+        os.utime(path, (st.st_atime, st.st_mtime))
+        stats2 = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                        starttime=1480999700,
+                                        endtime=1480999788,
+                                        cachedir=cachedir)
+        self.assertEqual(list(stats2.peerstats.times), [1480999786.0])
+
+        # a changed part is
+        with open(path, 'a') as fp:
+            fp.write("57728 17391.000 10.0.0.1 9014 0.001 0.02 0.003 0.4\n")
+        stats3 = ntp.statfiles.NTPStats(self.statsdir, sitename="test",
+                                        starttime=1480999700,
+                                        endtime=1481000000,
+                                        cachedir=cachedir)
+        self.assertEqual(len(stats3.peerstats), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
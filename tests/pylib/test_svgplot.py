@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import unittest
+import xml.dom.minidom
+import ntp.svgplot
+
+Program = u"""\
+$loop << EOD
+1480999000 0.5 -14.2
+1480999064 0.75 -14.3
+
+1480999192 0.25 -14.1
+EOD
+set grid
+set xdata time
+set xlabel "Time UTC"
+set xtics format "%d %b\\n%H:%MZ"
+set terminal png size 600,400
+set title "x & y: Offsets"
+set ytics format "%.1f µs" nomirror
+set y2tics format "%.1f ppm" nomirror
+set style line 1 lc rgb '#0060ad' lt 1 lw 1 pt 7 ps 0   # --- blue
+plot \\
+ $loop using 1:($2*1000000.0) title "offset µs" with linespoints ls 1, \\
+ $loop using 1:3 title "frequency" with linespoints axis x1y2, \\
+ 0.6 title "99th percentile"
+"""
+
+
+class TestPylibSvgplot(unittest.TestCase):
+
+    def test_unquote(self):
+        f = ntp.svgplot.unquote
+        self.assertEqual(f('"a\\nb" rest'), ("a\nb", " rest"))
+        self.assertEqual(f("'a\\nb'"), ("a\\nb", ""))
+        # gnuplot takes a missing closing quote
+        self.assertEqual(f('"open'), ("open", ""))
+
+    def test_ticks(self):
+        self.assertEqual(ntp.svgplot.ticks(0.1, 0.9, 4), [0.2, 0.4, 0.6, 0.8])
+        self.assertEqual(ntp.svgplot.timeticks(0, 86400, 4),
+                         [0, 6 * 3600, 12 * 3600, 18 * 3600, 86400])
+
+    def test_parse(self):
+        plot = ntp.svgplot.parse(Program)
+        self.assertEqual(plot.size, (600, 400))
+        self.assertEqual(plot.title, "x & y: Offsets")
+        self.assertTrue(plot.timex)
+        self.assertEqual(plot.styles, {1: '#0060ad'})
+        (offset, freq, line) = plot.series
+        # the blank line breaks the line
+        self.assertEqual(offset.segments,
+                         [[(1480999000, 500000.0), (1480999064, 750000.0)],
+                          [(1480999192, 250000.0)]])
+        self.assertEqual(freq.axis, 'y2')
+        self.assertEqual(line.kind, 'constant')
+        self.assertEqual(line.value, 0.6)
+
+    def test_render(self):
+        svg = ntp.svgplot.render(Program.encode('utf-8'))
+        # well formed, with the text escaped
+        doc = xml.dom.minidom.parseString(svg.encode('utf-8'))
+        self.assertEqual(doc.documentElement.getAttribute('width'), '600')
+        self.assertIn("x &amp; y: Offsets", svg)
+        # two lines, each broken in two
+        self.assertEqual(svg.count("<polyline"), 4)
+
+    def test_unsafe(self):
+        self.assertRaises(ValueError, ntp.svgplot.render,
+                          "plot '-' using 1:(system('true'))\n1 2\ne\n")
+        # allowed text that does not compute
+        for program in ("plot 1/0\n", "plot e\n",
+                        "plot '-' using 1:(e)\n1 2\ne\n",
+                        "plot '-' using 1:(v[\n1 2\ne\n"):
+            self.assertRaises(ValueError, ntp.svgplot.render, program)
+        # but a row that does not is skipped
+        plot = ntp.svgplot.parse("plot '-' using 1:(1/$2)\n1 0\n2 4\ne\n")
+        self.assertEqual(plot.series[0].segments, [[(2.0, 0.25)]])
+
+
+if __name__ == '__main__':
+    unittest.main()